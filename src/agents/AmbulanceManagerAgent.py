@@ -1,15 +1,26 @@
 from spade import agent, behaviour
 from spade.message import Message
-import traci
+from utils.traci_compat import traci
+from utils.WorldSnapshot import WORLD
+import asyncio
 import random
 import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 class AmbulanceManagerAgent(agent.Agent):
+    # MonitorAmbulanceBehaviour period while there are ambulances to monitor
+    MONITOR_PERIOD = 0.5
+
     def __init__(self, jid, password, monitor_jid):
         super().__init__(jid, password)
         self.monitor_jid = monitor_jid
         self.active_ambulances = {} # {veh_id: spawn_time}
         self.ambulance_counter = 0
+        self.ambulance_spawned = asyncio.Event()  # set on every spawn, wakes the idle monitor
+        self.rng = random.Random(os.getenv("AMBULANCE_SEED"))
 
     class SpawnAmbulanceBehaviour(behaviour.PeriodicBehaviour):
         async def run(self):
@@ -21,31 +32,40 @@ class AmbulanceManagerAgent(agent.Agent):
             
             if len(self.agent.active_ambulances) < 1:
                  try:
+                     # Read on every spawn: the trips' "!veh_id" routes are created and
+                     # deleted by SUMO as vehicles depart and arrive
                      routes = traci.route.getIDList()
                      if routes:
-                         route_id = random.choice(routes)
+                         route_id = self.agent.rng.choice(routes)
                          veh_id = f"ambulance_{self.agent.ambulance_counter}"
                          try:
                              traci.vehicle.add(veh_id, route_id, typeID="ambulance")
                              self.agent.active_ambulances[veh_id] = current_time
                              self.agent.ambulance_counter += 1
-                             print(f"[{self.agent.name}] SPAWNED AMBULANCE {veh_id} on route {route_id}")
+                             # wake the monitor now that there is something to monitor
+                             self.agent.ambulance_spawned.set()
+                             logger.info("[%s] SPAWNED AMBULANCE %s on route %s", self.agent.name, veh_id, route_id)
                          except Exception as e:
-                             print(f"[{self.agent.name}] Error spawning: {e}")
+                             logger.warning("[%s] Error spawning: %s", self.agent.name, e)
                  except Exception as e:
                      pass
 
     class MonitorAmbulanceBehaviour(behaviour.PeriodicBehaviour):
         async def run(self):
+            if not self.agent.active_ambulances:
+                # nothing to monitor: sleep until the next spawn instead of polling,
+                # then monitor the new ambulance straight away
+                self.agent.ambulance_spawned.clear()
+                await self.agent.ambulance_spawned.wait()
+
             if not traci.isLoaded(): return
 
-            try:
-                current_vehs = set(traci.vehicle.getIDList())
-                arrived_vehs = set(traci.simulation.getArrivedIDList())
-            except Exception:
-                return
+            # Shared snapshot, refreshed once per simulation step
+            current_vehs = WORLD.vehicle_ids
+            arrived_vehs = WORLD.arrived
             
             finished = []
+            send_tasks = []
             current_real_time = time.time()
             GRACE_PERIOD = 5.0 # seconds
 
@@ -76,16 +96,21 @@ class AmbulanceManagerAgent(agent.Agent):
                                 msg.set_metadata("performative", "request")
                                 # Format: priority_request:{veh_id}:{target_tls_id}
                                 msg.body = f"priority_request:{veh_id}:{tls_id}"
-                                await self.send(msg)
+                                send_tasks.append(self.send(msg))
                     except Exception as e:
-                        print(f"[{self.agent.name}] Error monitoring {veh_id}: {e}")
+                        logger.warning("[%s] Error monitoring %s: %s", self.agent.name, veh_id, e)
+
+            # Send the requests of all ambulances concurrently
+            if send_tasks:
+                await asyncio.gather(*send_tasks, return_exceptions=True)
 
+            # finished ids come from active_ambulances, so a single pop is enough
             for f in finished:
-                if f in self.agent.active_ambulances:
-                    del self.agent.active_ambulances[f]
-                    print(f"[{self.agent.name}] Ambulance {f} finished.")
+                self.agent.active_ambulances.pop(f, None)
+                logger.info("[%s] Ambulance %s finished.", self.agent.name, f)
 
     async def setup(self):
          print(f"[{self.jid}] Ambulance Manager started")
          self.add_behaviour(self.SpawnAmbulanceBehaviour(period=30)) 
-         self.add_behaviour(self.MonitorAmbulanceBehaviour(period=0.5)) 
+         self.monitor_behaviour = self.MonitorAmbulanceBehaviour(period=self.MONITOR_PERIOD)
+         self.add_behaviour(self.monitor_behaviour)
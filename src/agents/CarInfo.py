@@ -1,32 +1,288 @@
-import traci
+from utils.traci_compat import traci
+import traci.constants as tc
 from spade import agent, behaviour
 from spade.message import Message
-from spade.message import Message
-import threading
-import sys
+import asyncio
+import functools
+import time
+import logging
+import numpy as np
 import os
+from collections import OrderedDict
+from itertools import compress
+from concurrent.futures import ThreadPoolExecutor
+from utils.RouteFinder import RouteFinder
+from utils.WorldSnapshot import WORLD
+
+logger = logging.getLogger(__name__)
+
+# Network used by the shared RouteFinder, resolved from this file so it does not depend on the CWD
+NET_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), '../../sumo_environment/network.net.xml'))
+
+
+@functools.cache
+def get_route_finder():
+    """Shared RouteFinder instance, built on first use."""
+    logger.info("[CarInfo] Initializing shared RouteFinder with %s...", NET_FILE)
+    return RouteFinder(NET_FILE)
 
-# Ensure we can find the util
-sys.path.append(os.path.join(os.path.dirname(__file__), '../../'))
-from src.utils.RouteFinder import RouteFinder
 
 class CarInfoAgent(agent.Agent):
-    # Shared resource to track which vehicles are already claimed by an agent
-    claimed_vehicles = set()
-    claim_lock = threading.Lock()
+    # Shared resource to track which vehicles are already claimed by an agent:
+    # vehicle id -> jid of the owner. dict.setdefault/pop are atomic, so no lock is needed.
+    claimed_vehicles = {}
     
-    # Shared RouteFinder instance (Singleton)
-    route_finder = None
-    route_finder_lock = threading.Lock()
+    # Thread for RouteFinder searches off the event loop; searches run as one batch at a
+    # time (see solve_route_requests), so a single worker is enough
+    route_executor = ThreadPoolExecutor(max_workers=1)
+
+    # CarInfoBehaviour period; backs off up to MAX_IDLE_PERIOD while no vehicle can be claimed
+    CAR_INFO_PERIOD = 1
+    MAX_IDLE_PERIOD = 5.0
+
+    # Vehicle variables read by CarInfoBehaviour (tracking and rerouting)
+    VEHICLE_VARIABLES = [tc.VAR_TYPE, tc.VAR_ROAD_ID, tc.VAR_EDGES, tc.VAR_ROUTE_INDEX,
+                         tc.VAR_POSITION, tc.VAR_SPEED, tc.VAR_LANE_ID]
+
+    # Recent RouteFinder results shared by all agents:
+    # (current_edge, dest_edge) -> (timestamp, route)
+    route_cache = OrderedDict()
+    route_cache_max_size = 4096
+    route_cache_by_edge = {}  # edge_id -> cache keys whose route uses that edge
+    # Cache misses waiting for the next batched search: (current_edge, dest_edge) -> future
+    route_requests = {}
+    route_solver = None  # task running solve_route_requests while there are requests
+
+    # Static edge attributes shared by all agents (the network never changes)
+    edge_index = {}  # edge_id -> position in the arrays below
+    edge_length = np.empty(0)  # length (m)
+    edge_max_speed = np.empty(0)  # max speed (m/s)
+    edge_ideal_time = np.empty(0)  # length / max speed (s)
+
+    edge_lanes = {}  # edge_id -> lane ids
+    lane_ids = ()  # every lane, grouped by edge in edge_index order
+    lane_offsets = np.empty(0, dtype=np.intp)  # position in lane_ids of each edge's first lane
+
+    # Dynamic edge data, refreshed by EdgeStateListener after every step
+    blocked_edges = frozenset()  # edges with every lane closed to passenger cars
+    lane_blocked = np.empty(0, dtype=bool)  # lanes closed to passenger cars, over lane_ids
+    edge_blocked = np.empty(0, dtype=bool)  # same, as a mask over edge_index
+    edge_travel_time = np.empty(0)  # current travel time (s)
+    edge_tt_version = np.empty(0, dtype=np.int64)  # bumped when the travel time changes
+    edge_tt_tolerance = 0.5  # seconds; smaller changes keep the old value/version
+    network_epoch = 0  # bumped whenever a closure or a travel time changes anywhere
 
     def __init__(self, jid, password, monitor_jid):
         super().__init__(jid, password)
         self.monitor_jid = monitor_jid
-        self.rerouted_vehicles = set()
+        # State of the controlled vehicle (an agent controls at most one), reset on release
+        self.rerouted_current = False  # the controlled vehicle has been rerouted
+        self.last_reroute_check = None  # inputs of the last reroute evaluation
+        self.last_epoch_check = None  # (network_epoch, current edge) of the last reroute evaluation
         self.vehicle_id = None  # The specific vehicle this agent is controlling
+        self.route_plan = None  # cached route tuple last checked against the vehicle's route
+
+    def _release_vehicle(self):
+        """Give up the controlled vehicle: free its claim and reset the per-vehicle state."""
+        CarInfoAgent.claimed_vehicles.pop(self.vehicle_id, None)
+        self.vehicle_id = None
+        self.route_plan = None
+        self.rerouted_current = False
+        self.last_reroute_check = None
+        self.last_epoch_check = None
+
+    class EdgeStateListener(traci.StepListener):
+        """
+        After each simulation step, rebuilds CarInfoAgent.lane_blocked and blocked_edges from
+        the subscribed lane permissions and copies the subscribed edge travel times into
+        CarInfoAgent.edge_travel_time, bumping the version of every edge whose value changed.
+        """
+        def __init__(self, edges):
+            self.edges = edges
+
+        def step(self, t=0):
+            lane_results = traci.lane.getAllSubscriptionResults()
+            lanes = CarInfoAgent.lane_ids
+            lane_blocked = np.fromiter(
+                ("passenger" in lane_results.get(lane, {}).get(tc.LANE_DISALLOWED, ()) for lane in lanes),
+                dtype=bool, count=len(lanes))
+            CarInfoAgent.lane_blocked = lane_blocked
+            # an edge is closed when all of its lanes are: one AND over each edge's slice of lanes
+            blocked_mask = np.logical_and.reduceat(lane_blocked, CarInfoAgent.lane_offsets)
+            CarInfoAgent.edge_blocked = blocked_mask
+            blocked_edges = frozenset(compress(self.edges, blocked_mask))
+            newly_blocked = blocked_edges - CarInfoAgent.blocked_edges
+            if newly_blocked:
+                CarInfoAgent.invalidate_routes_through(newly_blocked)
+            if blocked_edges != CarInfoAgent.blocked_edges:
+                CarInfoAgent.network_epoch += 1
+            CarInfoAgent.blocked_edges = blocked_edges
+
+            results = traci.edge.getAllSubscriptionResults()
+            new_times = np.fromiter(
+                (results.get(e, {}).get(tc.VAR_CURRENT_TRAVELTIME, -1.0) for e in self.edges),
+                dtype=np.float64, count=len(self.edges))
+            # no travel time available -> fall back to length / maxSpeed
+            new_times = np.where(new_times >= 0, new_times, CarInfoAgent.edge_ideal_time)
+
+            changed = np.abs(new_times - CarInfoAgent.edge_travel_time) > CarInfoAgent.edge_tt_tolerance
+            if changed.any():
+                CarInfoAgent.edge_travel_time[changed] = new_times[changed]
+                CarInfoAgent.edge_tt_version[changed] += 1
+                CarInfoAgent.network_epoch += 1
+            return True
+
+    @classmethod
+    def cache_route(cls, key, route, now):
+        """Store a RouteFinder result and index it by every edge it uses."""
+        if key in cls.route_cache:
+            cls.uncache_route(key)
+        cls.route_cache[key] = (now, route)
+        for edge in route:
+            cls.route_cache_by_edge.setdefault(edge, set()).add(key)
+
+    @classmethod
+    def uncache_route(cls, key):
+        """Remove a cached route and its entries in the edge index."""
+        entry = cls.route_cache.pop(key, None)
+        if entry is None:
+            return
+        for edge in entry[1]:
+            keys = cls.route_cache_by_edge.get(edge)
+            if keys is not None:
+                keys.discard(key)
+
+    @classmethod
+    def invalidate_routes_through(cls, edges):
+        """Drop every cached route that uses one of the given (newly closed) edges."""
+        index = cls.route_cache_by_edge
+        stale = set().union(*(index.get(edge, ()) for edge in edges))
+        for key in stale:
+            cls.uncache_route(key)
+
+    @classmethod
+    async def solve_route_requests(cls):
+        """
+        Answer the queued route requests with one RouteFinder.find_routes_many call per
+        batch, in route_executor: every distinct start edge is solved in the same SciPy
+        call. Requests queued while a batch runs go into the next one.
+        """
+        loop = asyncio.get_running_loop()
+        while cls.route_requests:
+            requests, cls.route_requests = cls.route_requests, {}
+            pairs = list(requests)
+            blocked_edges = cls.blocked_edges
+            try:
+                route_finder = get_route_finder()
+                routes = await loop.run_in_executor(cls.route_executor, route_finder.find_routes_many,
+                                                    pairs, True, blocked_edges)
+            except Exception as e:
+                for future in requests.values():
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.monotonic()
+            newly_blocked = cls.blocked_edges - blocked_edges
+            for (current_edge, dest_edge), new_edges, future in zip(pairs, routes, requests.values()):
+                # an edge of the new route may have been closed while the search ran
+                if not newly_blocked.isdisjoint(new_edges):
+                    route = ()
+                else:
+                    # Every suffix of a shortest path is itself the shortest path to the
+                    # same destination, so vehicles further along this route are answered too
+                    route = tuple(new_edges)
+                    cls.cache_route((current_edge, dest_edge), route, now)
+                    for i in range(1, len(route) - 1):
+                        cls.cache_route((route[i], dest_edge), route[i:], now)
+                if not future.done():
+                    future.set_result(route)
+            while len(cls.route_cache) > cls.route_cache_max_size:
+                cls.uncache_route(next(iter(cls.route_cache)))
+
+    @classmethod
+    def load_edge_data(cls):
+        """
+        Read length/max speed of every edge once and subscribe to their travel times
+        and lane permissions, so closures and travel times come with every simulation step.
+        """
+        if cls.edge_index:
+            return
+        # Edges, first-lane lengths and lane ids as parsed from the net file by the shared
+        # RouteFinder (internal junction edges are left out: routes never use them)
+        try:
+            route_finder = get_route_finder()
+            edge_lanes = route_finder.lane_ids
+            edge_lengths = route_finder.edges
+        except Exception as e:
+            # no parsed network (SUMO reroutes instead): read the same over TraCI
+            logger.warning("[CarInfo] RouteFinder unavailable (%s), reading edges over TraCI", e)
+            edge_lanes = {edge: tuple(f"{edge}_{i}" for i in range(traci.edge.getLaneNumber(edge)))
+                          for edge in traci.edge.getIDList() if not edge.startswith(":")}
+            edge_lengths = {edge: traci.lane.getLength(lanes[0]) for edge, lanes in edge_lanes.items()}
+        edges = tuple(edge_lanes)
+        lengths = []
+        max_speeds = []
+        lane_ids = []
+        lane_offsets = []
+        for edge in edges:
+            lanes = edge_lanes[edge]
+            lengths.append(edge_lengths[edge])
+            # traci.edge has no getMaxSpeed, use the first lane
+            max_speeds.append(traci.lane.getMaxSpeed(lanes[0]))
+            traci.edge.subscribe(edge, [tc.VAR_CURRENT_TRAVELTIME])
+
+            cls.edge_lanes[edge] = lanes
+            lane_offsets.append(len(lane_ids))
+            lane_ids.extend(lanes)
+
+        cls.edge_length = np.array(lengths, dtype=np.float64)
+        cls.edge_max_speed = np.array(max_speeds, dtype=np.float64)
+        cls.edge_ideal_time = cls.edge_length / np.maximum(0.1, cls.edge_max_speed)
+        cls.edge_travel_time = cls.edge_ideal_time.copy()
+        cls.edge_tt_version = np.zeros(len(edges), dtype=np.int64)
+        cls.edge_blocked = np.zeros(len(edges), dtype=bool)
+        cls.lane_ids = tuple(lane_ids)
+        cls.lane_offsets = np.array(lane_offsets, dtype=np.intp)
+        cls.lane_blocked = np.zeros(len(lane_ids), dtype=bool)
+        # lanes are shared with other agents (e.g. traffic lights): subscribe through WORLD
+        WORLD.require_lanes(cls.lane_ids, [tc.LANE_DISALLOWED])
+        cls.edge_index = {edge: i for i, edge in enumerate(edges)}
+        traci.addStepListener(cls.EdgeStateListener(edges))
+
+    class CarInfoBehaviour(behaviour.PeriodicBehaviour):
+        """
+        Single periodic behaviour for the agent: tracks the controlled vehicle every tick,
+        checks for reroutes every reroute_check_period seconds and reports to the monitor
+        every report_period seconds (one SPADE timer per agent instead of three).
+        """
+        async def on_start(self):
+            self.next_report = 0.0
+            self.next_reroute = 0.0
 
-    class ReportStatusBehaviour(behaviour.PeriodicBehaviour):
         async def run(self):
+            now = time.monotonic()
+            if now >= self.next_report:
+                self.next_report = now + self.agent.report_period
+                await self.report_status()
+
+            if not traci.isLoaded():
+                return
+
+            # Single guard for the whole tick: the steps below read prebuilt caches and
+            # subscription results, only the TraCI commands they send can raise
+            try:
+                self.track_vehicle()
+
+                # Reroute only when we control a vehicle
+                if self.agent.vehicle_id is not None and now >= self.next_reroute:
+                    self.next_reroute = now + self.agent.reroute_check_period
+                    await self.check_reroute()
+            except Exception as e:
+                # protect behaviour from crashing on unexpected traci errors
+                logger.warning("[%s] Error handling vehicle %s: %s", self.agent.name, self.agent.vehicle_id, e)
+
+        async def report_status(self):
             """Envia um relatório de estado para o agente de monitorização."""
             if not traci.isLoaded():
                 return
@@ -34,230 +290,219 @@ class CarInfoAgent(agent.Agent):
             try:
                 status_msg = f"Status: {'Idle' if self.agent.vehicle_id is None else f'Controlling {self.agent.vehicle_id}'}"
                 if self.agent.vehicle_id:
-                     status_msg += f", Rerouted: {'Yes' if self.agent.vehicle_id in self.agent.rerouted_vehicles else 'No'}"
+                     status_msg += f", Rerouted: {'Yes' if self.agent.rerouted_current else 'No'}"
 
                 msg = Message(to=self.agent.monitor_jid)
                 msg.set_metadata("performative", "inform")
                 msg.body = status_msg
                 await self.send(msg)
             except Exception as e:
-                print(f"[{self.agent.name}] Error sending report: {e}")
+                logger.warning("[%s] Error sending report: %s", self.agent.name, e)
 
-    class CarInfoBehaviour(behaviour.PeriodicBehaviour):
-        async def run(self):
-            if not traci.isLoaded():
-                return
+        def track_vehicle(self):
+            """Claim a vehicle if needed, release it when it leaves and despawn it before a closed final edge."""
+            # Subscribed vehicle data, refreshed on every simulation step
+            vehicles = WORLD.vehicle_vars
 
             # If we don't have a vehicle, try to claim one
             if self.agent.vehicle_id is None:
-                car_ids = traci.vehicle.getIDList()
-                with CarInfoAgent.claim_lock:
-                    for cid in car_ids:
-                        if cid not in CarInfoAgent.claimed_vehicles:
-                            try:
-                                if traci.vehicle.getTypeID(cid) == "ambulance":
-                                    continue
-                            except Exception:
-                                pass
-                            self.agent.vehicle_id = cid
-                            CarInfoAgent.claimed_vehicles.add(cid)
-                            print(f"[{self.agent.name}] Claimed vehicle {cid}")
-                            break
+                me = str(self.agent.jid)
+                # unclaimed vehicles in one C-level set difference instead of a membership test per vehicle
+                for cid in vehicles.keys() - CarInfoAgent.claimed_vehicles.keys():
+                    if vehicles[cid].get(tc.VAR_TYPE) == "ambulance":
+                        continue
+                    # atomic claim: only one agent gets its jid stored for cid
+                    if CarInfoAgent.claimed_vehicles.setdefault(cid, me) == me:
+                        self.agent.vehicle_id = cid
+                        logger.info("[%s] Claimed vehicle %s", self.agent.name, cid)
+                        break
                 
                 # If still no vehicle, just return and wait for next tick
+                # (checking less often while there is nothing to claim)
                 if self.agent.vehicle_id is None:
+                    idle_period = self.period.total_seconds() * 1.5
+                    self.period = min(CarInfoAgent.MAX_IDLE_PERIOD, idle_period)
                     return
+                self.period = CarInfoAgent.CAR_INFO_PERIOD
 
             # If we have a vehicle, check if it still exists
-            if self.agent.vehicle_id not in traci.vehicle.getIDList():
-                print(f"[{self.agent.name}] Vehicle {self.agent.vehicle_id} finished/disappeared. Releasing.")
-                with CarInfoAgent.claim_lock:
-                    if self.agent.vehicle_id in CarInfoAgent.claimed_vehicles:
-                        CarInfoAgent.claimed_vehicles.remove(self.agent.vehicle_id)
-                self.agent.vehicle_id = None
+            if self.agent.vehicle_id not in vehicles:
+                logger.info("[%s] Vehicle %s finished/disappeared. Releasing.", self.agent.name, self.agent.vehicle_id)
+                self.agent._release_vehicle()
                 return
 
             # Monitor the specific vehicle
+            # (subscription data cannot disappear between reads, no per-read try needed)
             cid = self.agent.vehicle_id
-            try:
-                pos = traci.vehicle.getPosition(cid)
-                speed = traci.vehicle.getSpeed(cid)
-                route = traci.vehicle.getRoute(cid)
-                lane = traci.vehicle.getLaneID(cid)
-                # print(f"[{self.agent.name}] Monitoring {cid} -> Pos: {pos}, Speed: {speed:.2f}, Lane: {lane}")
-
-                # Check if next edge is final and closed
-                try:
-                    current_idx = traci.vehicle.getRouteIndex(cid)
-                    if current_idx >= 0 and current_idx + 1 < len(route):
-                        next_edge = route[current_idx + 1]
-                        # If next edge is the last one in the route
-                        if next_edge == route[-1]:
-                            # Check if closed
-                            is_closed = True
-                            try:
-                                lane_count = traci.edge.getLaneNumber(next_edge)
-                                for i in range(lane_count):
-                                    lane_id = f"{next_edge}_{i}"
-                                    disallowed = traci.lane.getDisallowed(lane_id)
-                                    if "passenger" not in disallowed:
-                                        is_closed = False
-                                        break
-                            except Exception:
-                                is_closed = False # Assume open if error checking edge
-                            
-                            if is_closed:
-                                print(f"[{self.agent.name}] Vehicle {cid} approaching final edge {next_edge} which is closed. Despawning as arrived.")
-                                traci.vehicle.remove(cid, reason=3) # 3 = REMOVE_ARRIVED
-                                with CarInfoAgent.claim_lock:
-                                    if self.agent.vehicle_id in CarInfoAgent.claimed_vehicles:
-                                        CarInfoAgent.claimed_vehicles.remove(self.agent.vehicle_id)
-                                self.agent.vehicle_id = None
-                                return
-
-                except Exception as e:
-                    print(f"[{self.agent.name}] Error checking final road for {cid}: {e}")
-
-            except Exception as e:
-                print(f"[{self.agent.name}] Error reading info for {cid}: {e}")
-
-    class RerouteBehaviour(behaviour.PeriodicBehaviour):
-        async def run(self):
-            # Reroute only when TraCI is available
-            if not traci.isLoaded():
+            data = vehicles[cid]
+            route = data[tc.VAR_EDGES]
+            logger.debug("[%s] Monitoring %s -> Pos: %s, Speed: %.2f, Lane: %s", self.agent.name, cid,
+                         data[tc.VAR_POSITION], data[tc.VAR_SPEED], data[tc.VAR_LANE_ID])
+
+            # Check if next edge is final and closed
+            current_idx = data[tc.VAR_ROUTE_INDEX]
+            if current_idx < 0 or current_idx + 1 >= len(route):
                 return
-            
+            next_edge = route[current_idx + 1]
+            # If next edge is the last one in the route
+            if next_edge != route[-1]:
+                return
+
+            # Check if closed
+            if next_edge in CarInfoAgent.blocked_edges:
+                logger.info("[%s] Vehicle %s approaching final edge %s which is closed. Despawning as arrived.", self.agent.name, cid, next_edge)
+                # WORLD subscribes every vehicle: unsubscribe first, or the next step
+                # raises "Vehicle is not known" under libsumo (the socket client only logs it)
+                traci.vehicle.unsubscribe(cid)
+                traci.vehicle.remove(cid, reason=3) # 3 = REMOVE_ARRIVED
+                self.agent._release_vehicle()
+
+        async def check_reroute(self):
+            """Reroute the controlled vehicle when its remaining route got much slower or is closed."""
             # Only act if we control a vehicle
             cid = self.agent.vehicle_id
             if cid is None:
                 return
 
-            try:
-                # Check if vehicle still exists (double check to avoid race conditions)
-                if cid not in traci.vehicle.getIDList():
-                    return
+            # Check if vehicle still exists (double check to avoid race conditions)
+            data = WORLD.vehicle_vars.get(cid)
+            if data is None:
+                return
 
-                route = traci.vehicle.getRoute(cid)
-                if not route:
-                    return
+            CarInfoAgent.load_edge_data()
 
-                # destination is last edge in route
-                dest_edge = route[-1]
+            route = data[tc.VAR_EDGES]
+            if not route:
+                return
 
-                # current edge/road
-                current_edge = traci.vehicle.getRoadID(cid)
+            # destination is last edge in route
+            dest_edge = route[-1]
 
-                # if vehicle already at destination edge, skip
-                if current_edge == dest_edge or current_edge == "":
-                    return
+            # current edge/road
+            current_edge = data[tc.VAR_ROAD_ID]
 
-                # find where we are in the route
-                try:
-                    # route_index: first occurrence of current_edge in route
-                    route_index = route.index(current_edge)
-                except ValueError:
-                    # current edge not in original planned route; set index 0
-                    route_index = 0
+            # if vehicle already at destination edge, skip
+            if current_edge == dest_edge or current_edge == "":
+                return
 
-                remaining_edges = route[route_index:]
+            # inside a junction (internal edge): RouteFinder only knows normal edges,
+            # evaluate again once the vehicle is on the next edge
+            if current_edge.startswith(":"):
+                return
 
-                # estimate remaining travel time using current traveltime estimates
-                remaining_time = 0.0
-                ideal_time = 0.0
-                
-                path_blocked = False
-
-                for edge in remaining_edges:
-                    # Check for road closures/disallowed permissions
-                    try:
-                        # traci.edge.getDisallowed does not exist. Must check lanes.
-                        # If all lanes are closed to passenger, the edge is blocked.
-                        path_blocked_edge = True
-                        lane_count = traci.edge.getLaneNumber(edge)
-                        for i in range(lane_count):
-                            lane_id = f"{edge}_{i}"
-                            disallowed = traci.lane.getDisallowed(lane_id)
-                            if "passenger" not in disallowed:
-                                path_blocked_edge = False
-                                break
-                        
-                        if path_blocked_edge:
-                            path_blocked = True
-                            remaining_time += 1e6 # Add huge penalty
-                    except Exception:
-                        pass
-                        
-                    try:
-                        remaining_time += float(traci.edge.getTraveltime(edge))
-                    except Exception:
-                        # if getTraveltime unavailable, fall back to length / maxSpeed
-                        try:
-                            remaining_time += float(traci.edge.getLength(edge)) / max(0.1, float(traci.edge.getMaxSpeed(edge)))
-                        except Exception:
-                            remaining_time += 0.0
-
-                    try:
-                        ideal_time += float(traci.edge.getLength(edge)) / max(0.1, float(traci.edge.getMaxSpeed(edge)))
-                    except Exception:
-                        ideal_time += 0.0
-
-                # decide if reroute
-                factor = self.agent.reroute_threshold_factor
-                max_delay = self.agent.max_allowed_delay
-
-                # if remaining_time is much larger than ideal OR absolute delay large OR path blocked
-                if (ideal_time > 0 and remaining_time > ideal_time * factor) or (remaining_time - ideal_time > max_delay) or path_blocked:
-                    # compute alternative route from current_edge to dest
-                    try:
-                        # Use custom RouteFinder instead of traci.simulation.findRoute
-                        # Initialize if needed (double-checked locking pattern)
-                        if CarInfoAgent.route_finder is None:
-                            with CarInfoAgent.route_finder_lock:
-                                if CarInfoAgent.route_finder is None:
-                                    # Assuming path is relative to repo root, or we can use absolute path
-                                    # Adjust this path if necessary to match runtime CWD
-                                    net_file = "sumo_environment/network.net.xml"
-                                    if not os.path.exists(net_file):
-                                        # If running from src/ or agents/, try stepping back
-                                        net_file = "../sumo_environment/network.net.xml" 
-                                        if not os.path.exists(net_file):
-                                             net_file = "../../sumo_environment/network.net.xml"
-                                    
-                                    print(f"[{self.agent.name}] Initializing shared RouteFinder with {net_file}...")
-                                    CarInfoAgent.route_finder = RouteFinder(net_file)
-
-                        print(f"[{self.agent.name}] Custom RouteFinder calculating route...")
-                        new_edges = CarInfoAgent.route_finder.find_route(current_edge, dest_edge)
-                        
-                    except Exception as e:
-                        print(f"[{self.agent.name}] RouteFinder error: {e}")
-                        new_edges = None
-
-                    if new_edges and len(new_edges) > 0 and new_edges != remaining_edges:
-                        try:
-                            traci.vehicle.setRoute(cid, new_edges)
-                            self.agent.rerouted_vehicles.add(cid)
-                            print(f"[{self.agent.name}] Rerouted vehicle {cid} (Path valid/better? {not path_blocked})")
-                        except Exception as e:
-                            print(f"[{self.agent.name}] Failed to set new route for {cid}: {e}")
+            # same network state and still on the same edge as the last evaluation:
+            # nothing can have changed, skip with a single comparison
+            epoch_key = (CarInfoAgent.network_epoch, current_edge)
+            if self.agent.last_epoch_check == epoch_key:
+                return
+            self.agent.last_epoch_check = epoch_key
 
-            except Exception as e:
-                # protect behaviour from crashing on unexpected traci errors
-                print(f"[{self.agent.name}] Error checking reroute for {cid}: {e}")
+            # where we are in the route, as reported by SUMO
+            # (also correct inside junctions and on routes that repeat an edge)
+            route_index = max(0, data[tc.VAR_ROUTE_INDEX])
+
+            remaining_edges = route[route_index:]
+
+            # estimate remaining travel time using current traveltime estimates
+            remaining_time = 0.0
+            ideal_time = 0.0
+            
+            idxs = np.fromiter((CarInfoAgent.edge_index[e] for e in remaining_edges), dtype=np.int32,
+                               count=len(remaining_edges))
+
+            # closed edges come from the lane permission subscription
+            blocked_count = int(CarInfoAgent.edge_blocked[idxs].sum())
+            path_blocked = blocked_count > 0
+            remaining_time += 1e6 * blocked_count # Add huge penalty per closed edge
+
+            # nothing changed since the last evaluation (same remaining edges, no
+            # travel time update on them, same closures) -> same decision, skip
+            check_key = (remaining_edges, int(CarInfoAgent.edge_tt_version[idxs].sum()), path_blocked)
+            if self.agent.last_reroute_check == check_key:
+                return
+            self.agent.last_reroute_check = check_key
+
+            remaining_time += float(CarInfoAgent.edge_travel_time[idxs].sum())
+            ideal_time = float(CarInfoAgent.edge_ideal_time[idxs].sum())
+
+            # decide if reroute
+            factor = self.agent.reroute_threshold_factor
+            max_delay = self.agent.max_allowed_delay
+
+            # if remaining_time is much larger than ideal OR absolute delay large OR path blocked
+            if (ideal_time > 0 and remaining_time > ideal_time * factor) or (remaining_time - ideal_time > max_delay) or path_blocked:
+                # compute alternative route from current_edge to dest
+                try:
+                    # Use custom RouteFinder instead of traci.simulation.findRoute
+                    new_edges = await self.find_route_cached(current_edge, dest_edge)
+                except Exception as e:
+                    # RouteFinder unavailable: let SUMO reroute server-side on current travel times
+                    logger.warning("[%s] RouteFinder error: %s, using SUMO rerouteTraveltime", self.agent.name, e)
+                    new_edges = None
+                    traci.vehicle.rerouteTraveltime(cid, currentTravelTimes=True)
+                    self.agent.rerouted_current = True
+
+                # Cached routes are shared tuples: getting the same object as last time means
+                # the vehicle already follows it, an O(1) identity test instead of comparing
+                # every edge. Otherwise compare with remaining_edges (also a tuple, from the
+                # subscription); tuple equality exits early on a length mismatch.
+                if new_edges and new_edges is not self.agent.route_plan:
+                    if new_edges != remaining_edges:
+                        traci.vehicle.setRoute(cid, new_edges)
+                        self.agent.rerouted_current = True
+                        logger.info("[%s] Rerouted vehicle %s (Path valid/better? %s)", self.agent.name, cid, not path_blocked)
+                    self.agent.route_plan = new_edges
+
+        async def find_route_cached(self, current_edge, dest_edge):
+            """
+            Return a route (tuple) from current_edge to dest_edge, reusing recent results of other
+            agents; cache hits return the shared cached tuple itself.
+            A cache miss is queued for solve_route_requests, which searches in route_executor so
+            the event loop (and every other agent) keeps running, batched with the misses of the
+            other agents; it only reads the parsed network and the blocked_edges snapshot,
+            never TraCI.
+            """
+            cache = CarInfoAgent.route_cache
+            key = (current_edge, dest_edge)
+            now = time.monotonic()
+
+            cached = cache.get(key)
+            if cached is not None and now - cached[0] < self.agent.route_cache_ttl:
+                cache.move_to_end(key)
+                return cached[1]
+
+            loop = asyncio.get_running_loop()
+            # agents missing the same pair wait on the same search
+            future = CarInfoAgent.route_requests.get(key)
+            if future is None:
+                future = CarInfoAgent.route_requests[key] = loop.create_future()
+            solver = CarInfoAgent.route_solver
+            if solver is None or solver.done():
+                CarInfoAgent.route_solver = loop.create_task(CarInfoAgent.solve_route_requests())
+
+            logger.debug("[%s] Custom RouteFinder calculating route...", self.agent.name)
+            # shield: a cancelled agent must not cancel the search other agents wait on
+            return await asyncio.shield(future)
 
     async def setup(self):
         print(f"[{self.jid}] Agente de Informação de Carros iniciado")
-        car_behaviour = self.CarInfoBehaviour(period=1)  # Check more frequently to claim vehicles fast
-        self.add_behaviour(car_behaviour)
-
-        # Reroute behaviour params
+        # CarInfoBehaviour reads these from the shared subscription results
+        WORLD.require(CarInfoAgent.VEHICLE_VARIABLES)
+        if traci.isLoaded():
+            CarInfoAgent.load_edge_data()
+        try:
+            get_route_finder()  # parse the network now, not on the first reroute
+        except Exception as e:
+            logger.warning("[%s] Could not load RouteFinder (%s), SUMO will reroute instead", self.name, e)
+
+        # Reroute params
         self.reroute_check_period = 2  # seconds between reroute evaluations
         self.reroute_threshold_factor = 1.5  # if remaining_time > ideal_time * factor => reroute
         self.max_allowed_delay = 20.0  # seconds of absolute delay beyond ideal to trigger reroute
+        self.route_cache_ttl = self.reroute_check_period * 2  # seconds a cached route stays valid
 
-        reroute_behaviour = self.RerouteBehaviour(period=self.reroute_check_period)
-        self.add_behaviour(reroute_behaviour)
+        # Relatório de estado para o monitor a cada 12s
+        self.report_period = 12
 
-        # Adiciona o comportamento de envio de relatórios
-        report_behaviour = self.ReportStatusBehaviour(period=12) # Envia relatório a cada 12s
-        self.add_behaviour(report_behaviour)
+        car_behaviour = self.CarInfoBehaviour(period=self.CAR_INFO_PERIOD)  # Check more frequently to claim vehicles fast
+        self.add_behaviour(car_behaviour)
@@ -1,14 +1,39 @@
-import traci
+from utils.traci_compat import traci, USE_LIBSUMO  # o libsumo não tem traci.gui
+from utils.WorldSnapshot import WORLD
 from spade import agent, behaviour
 import asyncio
+import logging
 import random
 
+logger = logging.getLogger(__name__)
+
 class DisruptionAgent(agent.Agent):
     LANE_LIST = ["E1_0", "E2_0" , "E3_0",
                  "E4_0", "E5_0", "E6_0", 
                  "E7_0", "E8_0", "E9_0",
                  "E10_0", "E11_0", "E12_0",
                  "E13_0", "E14_0", "E15_0", "E16_0"]
+    # (lane, lane do sentido oposto), calculado uma vez
+    LANE_PAIRS = tuple((lane, f"-{lane}") for lane in LANE_LIST)
+
+    def baseline_disallowed(self, lane_id):
+        """
+        Classes proibidas na lane sem interrupções, lidas do SUMO uma única vez
+        (as permissões só mudam pelas interrupções deste agente).
+        """
+        baseline = self.lane_baseline.get(lane_id)
+        if baseline is None:
+            baseline = tuple(c for c in traci.lane.getDisallowed(lane_id) if c != "passenger")
+            self.lane_baseline[lane_id] = baseline
+        return baseline
+
+    def close_lane(self, lane_id):
+        """Proíbe 'passenger' (carros) na lane: um único setDisallowed, sem ler o estado actual."""
+        traci.lane.setDisallowed(lane_id, list(self.baseline_disallowed(lane_id)) + ["passenger"])
+
+    def open_lane(self, lane_id):
+        """Repõe as permissões originais da lane."""
+        traci.lane.setDisallowed(lane_id, list(self.baseline_disallowed(lane_id)))
 
     class ManualDisruptionBehaviour(behaviour.OneShotBehaviour):
         def __init__(self, lane_id, duration):
@@ -22,132 +47,125 @@ class DisruptionAgent(agent.Agent):
             # Determine opposite lane (assuming simple dash prefix logic based on existing naming convention)
             opposite_lane_id = f"-{self.lane_id}" if not self.lane_id.startswith("-") else self.lane_id[1:]
             
-            print(f"[{self.agent.name}] MANUAL TRIGGER: Closing {self.lane_id} and {opposite_lane_id} for {self.duration}s")
             try:
-                # Close authorized lane
-                current_disallowed = set(traci.lane.getDisallowed(self.lane_id))
-                current_disallowed.add("passenger")
-                traci.lane.setDisallowed(self.lane_id, list(current_disallowed))
-                traci.gui.toggleSelection(self.lane_id, "lane")
-
-                # Close opposite lane
-                current_disallowed_opp = set(traci.lane.getDisallowed(opposite_lane_id))
-                current_disallowed_opp.add("passenger")
-                traci.lane.setDisallowed(opposite_lane_id, list(current_disallowed_opp))
-                traci.gui.toggleSelection(opposite_lane_id, "lane")
+                # Close authorized and opposite lane back to back (same simulation step),
+                # then the visual feedback, then the log
+                self.agent.close_lane(self.lane_id)
+                self.agent.close_lane(opposite_lane_id)
+                if self.agent.has_gui:
+                    traci.gui.toggleSelection(self.lane_id, "lane")
+                    traci.gui.toggleSelection(opposite_lane_id, "lane")
 
             except Exception as e:
-                print(f"[{self.agent.name}] Error closing lanes: {e}")
+                logger.warning("[%s] Error closing lanes: %s", self.agent.name, e)
                 return
+            logger.info("[%s] MANUAL TRIGGER: Closing %s and %s for %ss", self.agent.name, self.lane_id, opposite_lane_id, self.duration)
 
             await asyncio.sleep(self.duration)
             
             # Re-open
             if traci.isLoaded():
-                print(f"[{self.agent.name}] MANUAL TRIGGER: Opening {self.lane_id} and {opposite_lane_id}")
                 try:
-                    # Open authorized lane
-                    current_disallowed = set(traci.lane.getDisallowed(self.lane_id))
-                    if "passenger" in current_disallowed:
-                        current_disallowed.remove("passenger")
-                    traci.lane.setDisallowed(self.lane_id, list(current_disallowed))
-                    traci.gui.toggleSelection(self.lane_id, "lane") # toggle back
-
-                    # Open opposite lane
-                    current_disallowed_opp = set(traci.lane.getDisallowed(opposite_lane_id))
-                    if "passenger" in current_disallowed_opp:
-                        current_disallowed_opp.remove("passenger")
-                    traci.lane.setDisallowed(opposite_lane_id, list(current_disallowed_opp))
-                    traci.gui.toggleSelection(opposite_lane_id, "lane") # toggle back
+                    # Open authorized and opposite lane back to back
+                    self.agent.open_lane(self.lane_id)
+                    self.agent.open_lane(opposite_lane_id)
+                    if self.agent.has_gui:
+                        traci.gui.toggleSelection(self.lane_id, "lane") # toggle back
+                        traci.gui.toggleSelection(opposite_lane_id, "lane") # toggle back
 
                 except Exception as e:
-                    print(f"[{self.agent.name}] Error opening lanes: {e}")
+                    logger.warning("[%s] Error opening lanes: %s", self.agent.name, e)
+                    return
+                logger.info("[%s] MANUAL TRIGGER: Opening %s and %s", self.agent.name, self.lane_id, opposite_lane_id)
 
     def trigger_manual_disruption(self, lane_id, duration):
         b = self.ManualDisruptionBehaviour(lane_id, duration)
         self.add_behaviour(b)
-    class DisruptionBehaviour(behaviour.CyclicBehaviour):
-        async def on_start(self):
-            print(f"[{self.agent.name}] DisruptionBehaviour starting...")
-            # da algum tempo para o SUMO começar
-            await asyncio.sleep(5)
-
+    # Ciclo automático de interrupções: fecha durante CLOSURE_DURATION, abre durante OPEN_DURATION
+    CLOSURE_DURATION = 60  # seconds
+    OPEN_DURATION = 30     # seconds
+
+    def close_random_lanes(self):
+        """
+        Fecha uma linha aleatória e a do sentido oposto e agenda a reabertura.
+        Cada fase agenda a seguinte com loop.call_later, por isso não fica nenhuma
+        corrotina parada em asyncio.sleep entre fases.
+        """
+        # a simulação terminou: o ciclo pára
+        if not traci.isLoaded():
+            return
+
+        # escolhe uma linha aleatória e a do sentido oposto
+        target_lane, target_lane_1 = random.choice(DisruptionAgent.LANE_PAIRS)
+
+        # Close the road
+        try:
+            # proibe 'passenger' (carros) nas linhas e no sentido oposto, seguidos
+            self.close_lane(target_lane)
+            self.close_lane(target_lane_1)
+
+            # Feedback visual (muda cor)
+            if self.has_gui:
+                traci.gui.toggleSelection(target_lane, "lane")
+                traci.gui.toggleSelection(target_lane_1, "lane")
+
+            logger.info("[%s] CLOSING lanes %s and %s for %ss", self.name, target_lane, target_lane_1, self.CLOSURE_DURATION)
+        except Exception as e:
+            logger.warning("[%s] Error closing lane: %s", self.name, e)
+
+        loop = asyncio.get_running_loop()
+        self.disruption_timer = loop.call_later(self.CLOSURE_DURATION, self.open_lanes, target_lane, target_lane_1)
+
+    def open_lanes(self, target_lane, target_lane_1):
+        """Reabre as linhas fechadas por close_random_lanes e agenda o próximo fecho."""
+        # a simulação terminou: o ciclo pára
+        if not traci.isLoaded():
+            return
+
+        # Re-open the road
+        try:
+            # Abre as linhas e as do sentido oposto, seguidas
+            self.open_lane(target_lane)
+            self.open_lane(target_lane_1)
+
+            logger.info("[%s] OPENING lanes %s and %s for %ss", self.name, target_lane, target_lane_1, self.OPEN_DURATION)
+        except Exception as e:
+            logger.warning("[%s] Error opening lane: %s", self.name, e)
+
+        loop = asyncio.get_running_loop()
+        self.disruption_timer = loop.call_later(self.OPEN_DURATION, self.close_random_lanes)
+
+    class DisruptionBehaviour(behaviour.OneShotBehaviour):
+        """Arranca o ciclo de interrupções quando o SUMO estiver ligado."""
         async def run(self):
-            if not traci.isLoaded():
-                await asyncio.sleep(1)
-                return
-
-            # lista de linhas
-            lane_list = DisruptionAgent.LANE_LIST
-            
-            # lista de linhas (sentido oposto)
-            lane_1_list = ["-E1_0", "-E2_0" , "-E3_0",
-                         "-E4_0", "-E5_0", "-E6_0", 
-                         "-E7_0", "-E8_0", "-E9_0",
-                         "-E10_0", "-E11_0", "-E12_0",
-                         "-E13_0", "-E14_0", "-E15_0", "-E16_0"]
-
-            # escolhe uma linha aleatória
-            ran = random.randint(0, len(lane_list) - 1)
-
-            # Config
-            target_lane = lane_list[ran] # Using lane ID directly
-            target_lane_1 = lane_1_list[ran] # Using edge ID directly
-            closure_duration = 60  # seconds
-            open_duration = 30     # seconds
-
-            # Close the road
-            try:
-                # Para as linhas
-                print(f"[{self.agent.name}] CLOSING lane {target_lane} for {closure_duration}s")
-                # proibe 'passenger' (carros)
-                # traci.lane.getDisallowed retorna uma tuple/list de strings
-                current_disallowed = set(traci.lane.getDisallowed(target_lane))
-                current_disallowed.add("passenger")
-                traci.lane.setDisallowed(target_lane, list(current_disallowed))
-                
-                # Feedback visual (muda cor)
-                traci.gui.toggleSelection(target_lane, "lane") 
-
-                # Para as linhas (sentido oposto)
-                print(f"[{self.agent.name}] CLOSING lane {target_lane_1} for {closure_duration}s")
-                # proibe 'passenger' (carros)
-                # traci.lane.getDisallowed retorna uma tuple/list de strings
-                current_disallowed = set(traci.lane.getDisallowed(target_lane_1))
-                current_disallowed.add("passenger")
-                traci.lane.setDisallowed(target_lane_1, list(current_disallowed))
-                
-                # Feedback visual (muda cor)
-                traci.gui.toggleSelection(target_lane_1, "lane") 
-                
-            except Exception as e:
-                print(f"[{self.agent.name}] Error closing lane: {e}")
-
-            await asyncio.sleep(closure_duration)
-
-            # Re-open the road
-            if traci.isLoaded():
-                try:
-                    # Abre as linhas
-                    print(f"[{self.agent.name}] OPENING lane {target_lane} for {open_duration}s")
-                    current_disallowed = set(traci.lane.getDisallowed(target_lane))
-                    if "passenger" in current_disallowed:
-                        current_disallowed.remove("passenger")
-                    traci.lane.setDisallowed(target_lane, list(current_disallowed))
-                    
-                    # Abre as linhas (sentido oposto)
-                    print(f"[{self.agent.name}] OPENING lane {target_lane_1} for {open_duration}s")
-                    current_disallowed = set(traci.lane.getDisallowed(target_lane_1))
-                    if "passenger" in current_disallowed:
-                        current_disallowed.remove("passenger")
-                    traci.lane.setDisallowed(target_lane_1, list(current_disallowed))
-                    
-                except Exception as e:
-                    print(f"[{self.agent.name}] Error opening lane: {e}")
-
-            await asyncio.sleep(open_duration)
+            logger.info("[%s] DisruptionBehaviour starting...", self.agent.name)
+            # espera que o SUMO esteja ligado (sem tempo fixo nem polling)
+            await WORLD.ready.wait()
+            self.agent.close_random_lanes()
 
     async def setup(self):
         print(f"[{self.jid}] DisruptionAgent started")
+        # Permissões originais das lanes (lane_id -> classes proibidas), lidas antes de qualquer fecho
+        self.lane_baseline = {}
+        self.disruption_timer = None  # próxima fase do ciclo de interrupções (asyncio.TimerHandle)
+        # Feedback visual só com o sumo-gui: o libsumo não tem traci.gui e o sumo sem GUI
+        # responde com erro, verificado uma vez em vez de a cada fecho/abertura
+        self.has_gui = False
+        if traci.isLoaded() and not USE_LIBSUMO:
+            try:
+                self.has_gui = bool(traci.gui.getIDList())
+            except Exception:
+                self.has_gui = False
+        if traci.isLoaded():
+            for lane_pair in self.LANE_PAIRS:
+                for lane_id in lane_pair:
+                    self.baseline_disallowed(lane_id)
         b = self.DisruptionBehaviour()
         self.add_behaviour(b)
+
+    async def stop(self):
+        # cancela a próxima fase do ciclo de interrupções
+        timer = getattr(self, "disruption_timer", None)
+        if timer is not None:
+            timer.cancel()
+        await super().stop()
@@ -1,9 +1,22 @@
 import asyncio
-import traci
+import logging
+import os
+import numpy as np
+from utils.traci_compat import traci
+import traci.constants as tc
 from spade import agent, behaviour
 from spade.message import Message
 from spade.template import Template
 from utils.CongestionPredictor import CongestionPredictor
+from utils.WorldSnapshot import WORLD
+
+logger = logging.getLogger(__name__)
+
+# Rede da simulação, para o comprimento total usado na densidade de veículos
+NET_FILE = os.path.normpath(os.path.join(os.path.dirname(__file__), '../../sumo_environment/network.net.xml'))
+
+# Texto do estado exibido, indexado pela previsão (0 = normal, 1 = congestionado)
+STATUS_LABELS = ("🟢 NORMAL", "🔴 CONGESTIONADO")
 
 
 class MonitoringAgent(agent.Agent):
@@ -16,37 +29,47 @@ class MonitoringAgent(agent.Agent):
         """
         Comportamento periódico para recolher e exibir dados da simulação.
         """
+        async def on_start(self):
+            # espera que o SUMO esteja ligado em vez de testar a cada ciclo
+            await WORLD.ready.wait()
+            # treino em curso numa thread (no máximo um de cada vez)
+            self.train_future = None
+
         async def run(self):
             if not traci.isLoaded():
                 return
 
-            step = traci.simulation.getTime()
+            step = WORLD.time
             
             # Coletar features e fazer previsão de congestionamento
+            # As velocidades chegam todas numa única resposta da subscrição
+            # (veículos que já saíram deixam de aparecer nos resultados);
+            # copiadas directamente para um array NumPy, sem lista intermédia
             predictor = self.agent.congestion_predictor
-            sample = predictor.collect_features()
+            results = WORLD.vehicle_vars
+            speeds = np.fromiter((r[tc.VAR_SPEED] for r in results.values()),
+                                 dtype=np.float64, count=len(results))
+            sample = predictor.collect_features(speeds)
             
             if sample:
                 features, label = sample
                 
-                # Fazer previsão
-                congestion_prob = predictor.get_congestion_probability(features)
-                prediction = predictor.predict(features)
-                
-                # Exibir previsão a cada 5 segundos
-                if int(step) % 5 == 0:
-                    status = "🔴 CONGESTIONADO" if prediction == 1 else "🟢 NORMAL"
-                    print(f"[Monitor] Step {int(step)}s | {status} | Probabilidade: {congestion_prob:.1%} | Veículos: {int(features[0])} | Vel.Média: {features[1]:.1f}m/s")
+                # Fazer e exibir previsão a cada 5 segundos (a previsão só é usada para exibir)
+                if int(step) % 5 == 0 and logger.isEnabledFor(logging.INFO):
+                    congestion_prob = predictor.get_congestion_probability(features)
+                    prediction = predictor.predict(features)
+                    logger.info("[Monitor] Step %ds | %s | Probabilidade: %.1f%% | Veículos: %d | Vel.Média: %.1fm/s",
+                                int(step), STATUS_LABELS[prediction], congestion_prob * 100, int(features[0]), features[1])
                 
                 # Adicionar amostra para treinamento
                 predictor.add_sample(features, label)
                 
-                # Treinar modelo periodicamente
-                if predictor.should_train() and not predictor.is_trained:
-                    predictor.train()
-                elif predictor.is_trained and len(predictor.training_features) >= predictor.min_samples_to_train:
-                    # Retreinar com novos dados
-                    predictor.train()
+                # Treinar (ou retreinar com novos dados) periodicamente, numa thread:
+                # o fit do scikit-learn e a gravação dos dados bloqueariam o event loop
+                # e com ele todos os outros agentes
+                if predictor.should_train() and (self.train_future is None or self.train_future.done()):
+                    loop = asyncio.get_running_loop()
+                    self.train_future = loop.run_in_executor(None, predictor.train)
 
             # Exibir estados dos agentes (comentado)
             '''if self.agent.agent_states:
@@ -56,14 +79,43 @@ class MonitoringAgent(agent.Agent):
 
     class ReceiveReportBehaviour(behaviour.CyclicBehaviour):
         """
-        Comportamento cíclico para receber e processar relatórios de outros agentes.
+        Comportamento cíclico que recebe todas as mensagens do monitor e despacha pela
+        performative: relatórios de estado (inform) e pedidos de prioridade (request),
+        e.g. de ambulâncias, que são encaminhados para o semáforo correto.
         """
         async def run(self):
             msg = await self.receive(timeout=10)  # Espera por uma mensagem por 10 segundos
-            if msg:
-                # Atualiza o estado do agente que enviou a mensagem
-                self.agent.agent_states[str(msg.sender)] = msg.body
-                print(f"[Monitor] Received report from {msg.sender}: {msg.body}")
+            if not msg:
+                return
+            if msg.get_metadata("performative") == "request":
+                await self.forward_priority_request(msg)
+                return
+            # Atualiza o estado do agente que enviou a mensagem
+            # (o JID já é hashable, serve directamente de chave)
+            self.agent.agent_states[msg.sender] = msg.body
+            logger.debug("[Monitor] Received report from %s: %s", msg.sender, msg.body)
+
+        async def forward_priority_request(self, msg):
+            """Encaminha um pedido de prioridade para o agente do semáforo indicado."""
+            content = msg.body
+            # Esperado: "priority_request:{veh_id}:{tls_id}"
+            if not content or not content.startswith("priority_request:") or not hasattr(self.agent, 'tls_mapping'):
+                return
+            try:
+                _, veh_id, tls_id = content.split(":", 2)
+
+                tls_jid = self.agent.tls_mapping.get(tls_id)
+                if tls_jid:
+                    # Encaminha o pedido para o agente de semáforo
+                    forward_msg = Message(to=tls_jid)
+                    forward_msg.set_metadata("performative", "request")
+                    forward_msg.body = f"priority_request:{veh_id}"
+                    await self.send(forward_msg)
+                    logger.info("[Monitor] Encaminhando pedido de %s para %s (%s)", veh_id, tls_id, tls_jid)
+                else:
+                    logger.warning("[Monitor] TLS ID %s não encontrado no mapeamento.", tls_id)
+            except Exception as e:
+                logger.warning("[Monitor] Erro ao processar pedido de prioridade: %s", e)
 
     async def setup(self):
         """
@@ -76,58 +128,29 @@ class MonitoringAgent(agent.Agent):
         self.congestion_predictor = CongestionPredictor(
             congestion_threshold=5.0,  # 5 m/s = ~18 km/h
             min_samples_to_train=50,
-            data_dir="ml_data"  # Diretório para persistência de dados
+            data_dir="ml_data",  # Diretório para persistência de dados
+            # comprimento da rede lido do .net.xml (evita um pedido TraCI por edge
+            # na primeira amostra; sem o ficheiro, o preditor recorre ao TraCI)
+            net_file=NET_FILE
         )
         print(f"[Monitor] 🧠 CongestionPredictor inicializado (ML ativado)")
 
+        # Subscrições TraCI: velocidades de todos os veículos numa só ida ao SUMO
+        WORLD.require([tc.VAR_SPEED])
+
         # Comportamento para monitorizar a simulação
         monitor_behaviour = self.MonitorBehaviour(period=1)  # executa a cada 1s
         self.add_behaviour(monitor_behaviour)
 
-        # Comportamento para receber relatórios de outros agentes
+        # Comportamento para receber relatórios de outros agentes e gerir prioridades
+        # (um único ciclo de receção para os dois tipos de mensagem)
         report_template = Template()
         report_template.set_metadata("performative", "inform")
-        receive_behaviour = self.ReceiveReportBehaviour()
-        self.add_behaviour(receive_behaviour, report_template)
-
-        # Comportamento para gerir prioridades
         priority_template = Template()
         priority_template.set_metadata("performative", "request")
-        priority_behaviour = self.PriorityManagerBehaviour()
-        self.add_behaviour(priority_behaviour, priority_template)
+        receive_behaviour = self.ReceiveReportBehaviour()
+        self.add_behaviour(receive_behaviour, report_template | priority_template)
 
     def set_tls_mapping(self, mapping):
         """Define o mapeamento de TLS ID para JID."""
         self.tls_mapping = mapping
-
-    class PriorityManagerBehaviour(behaviour.CyclicBehaviour):
-        """
-        Recebe pedidos de prioridade (e.g., de ambulâncias) e encaminha para o semáforo correto.
-        """
-        async def run(self):
-            msg = await self.receive(timeout=10)
-            if msg:
-                content = msg.body
-                # Esperado: "priority_request:{veh_id}:{tls_id}"
-                if "priority_request" in content and hasattr(self.agent, 'tls_mapping'):
-                    try:
-                         parts = content.split(":")
-                         if len(parts) >= 3:
-                             veh_id = parts[1]
-                             tls_id = parts[2]
-                             
-                             tls_jid = self.agent.tls_mapping.get(tls_id)
-                             if tls_jid:
-                                 # Encaminha o pedido para o agente de semáforo
-                                 forward_msg = Message(to=tls_jid)
-                                 forward_msg.set_metadata("performative", "request")
-                                 forward_msg.body = f"priority_request:{veh_id}"
-                                 await self.send(forward_msg)
-                                 print(f"[Monitor] Encaminhando pedido de {veh_id} para {tls_id} ({tls_jid})")
-                             else:
-                                 print(f"[Monitor] TLS ID {tls_id} não encontrado no mapeamento.")
-                    except Exception as e:
-                        print(f"[Monitor] Erro ao processar pedido de prioridade: {e}")
-
-
-
@@ -7,8 +7,14 @@ Este agente controla um conjunto de semáforos numa interseção do SUMO.
 Ele observa as filas através do TraCI e ajusta o tempo do verde dinamicamente.
 
 Algoritmo (melhoria):
- - A cada ciclo (period=2s) o agente coleta por-lane o número de veículos e tempo de espera.
- - Calcula uma "demanda" por fase: demanda = vehicles + 0.2 * waiting_time.
+ - A cada ciclo (CONTROL_INTERVAL=2s de simulação) o agente coleta por-lane o número de veículos e tempo de espera.
+ - Calcula um índice de prioridade por fase (Helbing/Lämmer):
+     prioridade = (n + n_hat + 0.2 * w) / (tau + g_hat)
+   n: veículos parados (fila) nas lanes com verde, n_hat: veículos a chegar (em movimento),
+   w: tempo de espera acumulado nessas lanes (o termo da demanda original),
+   tau: tempo de transição até à fase, a soma dos tempos de amarelo / vermelho (yellow_time /
+   red_time) das fases pelo caminho (0 para a fase atual), g_hat: verde necessário para escoar a fila
+   (max(min_green, n * discharge_time)).
  - Prioriza a fase com maior demanda; se outra fase tiver demanda significativamente maior
      (fator configurável) e o tempo mínimo na fase atual já passou, inicia a transição.
  - Mantém limites mínimo e máximo para o tempo de verde por fase (min_green / max_green).
@@ -17,6 +23,7 @@ Parâmetros tunáveis:
  - green_time_duration: tempo alvo atual de verde (inicial 10s)
  - min_green / max_green: limites para o verde (5s / 20s)
  - yellow_time / red_time: tempos fixos de segurança (4s cada)
+ - discharge_time: tempo por veículo para escoar a fila (2s)
  - demand_threshold_factor: quanto maior a demanda da melhor fase em relação à atual para forçar troca (default 1.25)
 
 Essa abordagem busca reduzir o tempo de espera médio priorizando direções com filas maiores,
@@ -26,11 +33,170 @@ Autor: (tu)
 """
 
 from spade import agent, behaviour
-import traci
+from utils.traci_compat import traci
+import traci.constants as tc
+from utils.WorldSnapshot import WORLD
 import asyncio
+import logging
+import numpy as np
 import warnings
 from spade.message import Message
 
+logger = logging.getLogger(__name__)
+
+# Variáveis subscritas (via WORLD) nas lanes controladas, em cada semáforo e nos veículos
+# (a lane da ambulância nos pedidos de prioridade)
+LANE_VARS = (tc.LAST_STEP_VEHICLE_NUMBER, tc.VAR_WAITING_TIME, tc.LAST_STEP_VEHICLE_HALTING_NUMBER)
+TLS_VARS = (tc.TL_CURRENT_PHASE,)
+VEHICLE_VARS = (tc.VAR_LANE_ID,)
+
+
+class TrafficManager:
+    """
+    Estado das lanes de todos os semáforos num só par de arrays (veículos, espera).
+
+    Cada semáforo regista as suas lanes controladas; as lanes partilhadas entre
+    interseções só ocupam uma posição. Em cada passo de simulação os arrays são
+    preenchidos uma única vez a partir do WORLD, e cada agente lê a sua parte com
+    um índice (tls_lanes) em vez de percorrer as lanes em Python.
+    """
+
+    def __init__(self):
+        self.all_lanes = []   # lanes de todos os semáforos, sem repetições
+        self.lane_index = {}  # lane_id -> posição em all_lanes
+        self.tls_lanes = {}   # tls_id -> índices (em all_lanes) das lanes controladas
+        self.veh = np.zeros(0)
+        self.wait = np.zeros(0)
+        self.halt = np.zeros(0)
+        self.version = -1     # versão do WORLD dos arrays
+
+    def register(self, tls_id, controlled_lanes):
+        """Regista as lanes controladas por um semáforo e subscreve as novas."""
+        for lane in controlled_lanes:
+            if lane not in self.lane_index:
+                self.lane_index[lane] = len(self.all_lanes)
+                self.all_lanes.append(lane)
+        self.tls_lanes[tls_id] = np.fromiter(
+            (self.lane_index[lane] for lane in controlled_lanes), dtype=np.intp, count=len(controlled_lanes))
+        WORLD.require_lanes(self.all_lanes, LANE_VARS)
+        self.version = -1
+
+    def refresh(self):
+        """Actualiza os arrays a partir das subscrições, no máximo uma vez por passo."""
+        if self.version == WORLD.version:
+            return
+        lane_vars = WORLD.lane_vars
+        empty = {}
+        # uma só passagem pelas lanes: linha = lane, colunas = (veículos, espera, parados)
+        rows = [(d.get(tc.LAST_STEP_VEHICLE_NUMBER, 0), d.get(tc.VAR_WAITING_TIME, 0.0),
+                 d.get(tc.LAST_STEP_VEHICLE_HALTING_NUMBER, 0))
+                for d in (lane_vars.get(lane, empty) for lane in self.all_lanes)]
+        table = np.array(rows, dtype=np.float64).reshape(len(rows), 3).T
+        self.veh, self.wait, self.halt = table[0], table[1], table[2]
+        self.version = WORLD.version
+
+    def lanes(self, tls_id):
+        """(veículos, espera, parados) por lane controlada do semáforo, pela ordem de controlled_lanes."""
+        self.refresh()
+        idx = self.tls_lanes.get(tls_id)
+        if idx is None:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        return self.veh[idx], self.wait[idx], self.halt[idx]
+
+
+# Instância única partilhada por todos os TrafficLightAgents
+TRAFFIC = TrafficManager()
+
+
+# Quanto maior a prioridade da melhor fase em relação à atual para forçar troca
+DEMAND_THRESHOLD_FACTOR = 1.25
+# Peso do tempo de espera (s) no índice de prioridade, em veículos equivalentes
+WAITING_WEIGHT = 0.2
+
+
+# Tipo de cada fase (TrafficLightAgent.phase_kind), índice em _PHASE_HANDLERS
+PHASE_GREEN, PHASE_YELLOW, PHASE_RED = 0, 1, 2
+
+
+def _next_from_green(green_mask, lane_vehicles, lane_halting, lane_waiting, phase_tau,
+                     current_phase, time_on_phase, green_time_duration,
+                     min_green, max_green, yellow_time, red_time, discharge_time):
+    """Fase VERDE: ajusta o verde alvo e troca se outra fase tiver prioridade muito maior."""
+    # === Per-phase priority index ===
+    # green_mask (fases x lanes) soma as lanes com verde de todas as fases num só
+    # produto matriz-vector: n = fila (parados), n_hat = veículos em movimento (a chegar),
+    # w = tempo de espera
+    n = green_mask @ lane_halting
+    n_hat = green_mask @ (lane_vehicles - lane_halting)
+    w = green_mask @ lane_waiting
+    # verde necessário para escoar a fila de cada fase
+    g_hat = np.maximum(min_green, n * discharge_time)
+    # tau: transição a partir da fase atual (linha de phase_tau)
+    phase_demands = np.divide(n + n_hat + WAITING_WEIGHT * w, phase_tau[current_phase] + g_hat)
+
+    # Escolhe a fase com maior demanda (prioridade)
+    best_phase = int(phase_demands.argmax())
+    current_phase_demand = phase_demands[current_phase]
+    best_phase_demand = phase_demands[best_phase]
+
+    # Lógica Adaptativa: ajusta o tempo alvo de verde com base no tráfego total
+    total_vehicles = lane_vehicles.sum()
+    if total_vehicles > 10 and green_time_duration < max_green:
+        green_time_duration = min(max_green, green_time_duration + 2)
+    elif total_vehicles < 3 and green_time_duration > min_green:
+        green_time_duration = max(min_green, green_time_duration - 1)
+
+    # Decide se inicia a transição para a próxima fase (normalmente o amarelo):
+    # - Se passou o tempo mínimo E outra fase tem demanda significativamente maior
+    # - Ou se atingiu o tempo máximo planejado para esta fase
+    if ((time_on_phase >= min_green and best_phase != current_phase
+            and best_phase_demand > current_phase_demand * DEMAND_THRESHOLD_FACTOR)
+            or time_on_phase >= green_time_duration):
+        return (current_phase + 1) % len(phase_tau), green_time_duration
+    return current_phase, green_time_duration
+
+
+def _next_from_yellow(green_mask, lane_vehicles, lane_halting, lane_waiting, phase_tau,
+                      current_phase, time_on_phase, green_time_duration,
+                      min_green, max_green, yellow_time, red_time, discharge_time):
+    """Fase AMARELO: dura um tempo fixo."""
+    if time_on_phase >= yellow_time:
+        return (current_phase + 1) % len(phase_tau), green_time_duration
+    return current_phase, green_time_duration
+
+
+def _next_from_red(green_mask, lane_vehicles, lane_halting, lane_waiting, phase_tau,
+                   current_phase, time_on_phase, green_time_duration,
+                   min_green, max_green, yellow_time, red_time, discharge_time):
+    """Fase de TRANSIÇÃO/VERMELHO: tempo fixo até ao próximo verde."""
+    if time_on_phase >= red_time:
+        return (current_phase + 1) % len(phase_tau), green_time_duration
+    return current_phase, green_time_duration
+
+
+_PHASE_HANDLERS = (_next_from_green, _next_from_yellow, _next_from_red)
+
+
+def decide_next_phase(green_mask, lane_vehicles, lane_halting, lane_waiting, phase_tau, phase_kind,
+                      current_phase, time_on_phase, green_time_duration,
+                      min_green, max_green, yellow_time, red_time, discharge_time):
+    """
+    Núcleo numérico do ControlBehaviour: decide a próxima fase só a partir de arrays
+    e escalares (o TraCI e o SPADE ficam no comportamento).
+
+    O tipo da fase atual (phase_kind, pré-calculado) escolhe o handler numa tabela,
+    sem percorrer a string de estado da fase.
+
+    Devolve (próxima fase, novo tempo alvo de verde); a próxima fase é a atual
+    quando não há mudança.
+    """
+    if len(phase_kind) == 0:
+        return current_phase, green_time_duration
+    handler = _PHASE_HANDLERS[phase_kind[current_phase]]
+    return handler(green_mask, lane_vehicles, lane_halting, lane_waiting, phase_tau,
+                   current_phase, time_on_phase, green_time_duration,
+                   min_green, max_green, yellow_time, red_time, discharge_time)
+
 
 class TrafficLightAgent(agent.Agent):
     def __init__(self, jid, password, tls_id, monitor_jid):
@@ -38,209 +204,129 @@ class TrafficLightAgent(agent.Agent):
         self.tls_id = tls_id
         self.monitor_jid = monitor_jid
 
+    # Intervalo (s de simulação) entre decisões de controlo, independente do ritmo dos passos
+    CONTROL_INTERVAL = 2
+
+    # Metadados comuns a todos os relatórios de estado
+    REPORT_METADATA = {"performative": "inform"}
+
     class ReportStatusBehaviour(behaviour.PeriodicBehaviour):
+        async def on_start(self):
+            # envios em curso (referência forte até terminarem)
+            self.pending_sends = set()
+
         async def run(self):
             """Envia um relatório de estado para o agente de monitorização."""
             if not traci.isLoaded():
                 return
 
+            # fase lida pelo ControlBehaviour no último ciclo (sem pedido ao SUMO)
+            current_phase = self.agent.current_phase
+            if current_phase is None:
+                return
+
             try:
-                current_phase = traci.trafficlight.getPhase(self.agent.tls_id)
-                time_on_phase = traci.simulation.getTime() - self.agent.current_phase_start_time
-                status_msg = f"Phase: {current_phase}, Time on phase: {time_on_phase:.1f}s"
-
-                msg = Message(to=self.agent.monitor_jid)
-                msg.set_metadata("performative", "inform")
-                msg.body = status_msg
-                await self.send(msg)
+                time_on_phase = WORLD.time - self.agent.current_phase_start_time
+                status_msg = "Phase: %d, Time on phase: %.1fs" % (current_phase, time_on_phase)
+
+                msg = Message(to=self.agent.monitor_jid, body=status_msg,
+                              metadata=TrafficLightAgent.REPORT_METADATA)
+                # envio em segundo plano: o comportamento devolve logo o controlo ao event loop
+                task = asyncio.create_task(self.send(msg))
+                self.pending_sends.add(task)
+                task.add_done_callback(self.send_done)
             except Exception as e:
-                print(f"[{self.agent.name}] Error sending report: {e}")
-
-    class ControlBehaviour(behaviour.PeriodicBehaviour):
-        async def run(self):
+                logger.warning("[%s] Error sending report: %s", self.agent.name, e)
 
-            current_time = traci.simulation.getTime()
+        def send_done(self, task):
+            self.pending_sends.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning("[%s] Error sending report: %s", self.agent.name, task.exception())
 
-
-            """Ciclo principal do agente — executa a cada 2 segundos."""
+    class ControlBehaviour(behaviour.CyclicBehaviour):
+        async def run(self):
+            """Ciclo principal do agente — decide a cada CONTROL_INTERVAL segundos de simulação."""
+
+            # Acorda uma vez por passo de simulação (a qualquer ritmo, também com
+            # ARCANUM_STEP_DELAY=0); só decide quando passou CONTROL_INTERVAL de simulação
+            await WORLD.next_step()
+            current_time = WORLD.time
+            last_time = self.agent.last_control_time
+            if last_time is not None and current_time - last_time < TrafficLightAgent.CONTROL_INTERVAL:
+                return
+            self.agent.last_control_time = current_time
 
             # Identificador do semáforo controlado (ex: "junction_0")
             tls_id = self.agent.tls_id
 
-            # Obtém estado atual do semáforo no SUMO
-            current_phase = traci.trafficlight.getPhase(tls_id)
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                logic = traci.trafficlight.getCompleteRedYellowGreenDefinition(tls_id)[0]
-            phases = logic.getPhases()
+            # Fase atual subscrita no WORLD (o programa de fases é fixo, lido no setup)
+            agent = self.agent
+            current_phase = agent.phase_now()
 
-            # Contar veículos nas lanes controladas
-            lanes = traci.trafficlight.getControlledLanes(tls_id)
-            total_vehicles = sum(traci.lane.getLastStepVehicleNumber(lane) for lane in lanes)
-            avg_waiting = (
-                sum(traci.lane.getWaitingTime(lane) for lane in lanes) / len(lanes)
-                if lanes else 0
-            )
-
-            #print(f"[{self.agent.name}] Veículos: {total_vehicles}, Espera média: {avg_waiting:.2f}s")
+            # Veículos e tempo de espera por lane controlada, dos arrays partilhados (sem pedidos ao SUMO)
+            lane_vehicles, lane_waiting, lane_halting = TRAFFIC.lanes(tls_id)
 
             time_on_phase = current_time - self.agent.current_phase_start_time
-            #print(f"[{self.agent.name}] Tempo na Fase {current_phase}: {time_on_phase:.1f}s")
-
-
-            # === Per-phase demand scoring ===
-            # Para cada fase, somamos os veículos e o tempo de espera das lanes que têm verde nessa fase.
-            phase_demands = []
-            controlled_lanes = lanes
-            for i, phase in enumerate(phases):
-                demand_veh = 0
-                demand_wait = 0
-                # A string phase.state tem um char por lane na mesma ordem de controlled_lanes
-                for lane_idx, lane_id in enumerate(controlled_lanes):
-                    if lane_idx < len(phase.state) and phase.state[lane_idx] in ("g", "G"):
-                        try:
-                            v = traci.lane.getLastStepVehicleNumber(lane_id)
-                            w = traci.lane.getWaitingTime(lane_id)
-                        except Exception:
-                            v, w = 0, 0
-                        demand_veh += v
-                        demand_wait += w
-                # Score combina número de veículos com espera, ponderando espera menos que contagem
-                score = demand_veh + 0.2 * (demand_wait)
-                phase_demands.append(score)
-
-            # Escolhe a fase com maior demanda (prioridade)
-            best_phase = max(range(len(phases)), key=lambda i: phase_demands[i]) if phases else current_phase
-            current_phase_demand = phase_demands[current_phase] if phases else 0
-            best_phase_demand = phase_demands[best_phase] if phases else 0
-
-            #print(f"[{self.agent.name}] Demanda por fase: {[round(x,1) for x in phase_demands]}")
-
-            # 1. Lógica para as Fases VERDE (Green)
-            if "g" in phases[current_phase].state or "G" in phases[current_phase].state:  # se verde atual
-
-                # Lógica Adaptativa: ajusta o tempo alvo de verde com base no tráfego total
-                if total_vehicles > 10 and self.agent.green_time_duration < self.agent.max_green:
-                    self.agent.green_time_duration = min(self.agent.max_green, self.agent.green_time_duration + 2)
-                    #print(f"[{self.agent.name}] Estendendo verde para {self.agent.green_time_duration}s")
-                elif total_vehicles < 3 and self.agent.green_time_duration > self.agent.min_green:
-                    self.agent.green_time_duration = max(self.agent.min_green, self.agent.green_time_duration - 1)
-                    #print(f"[{self.agent.name}] Reduzindo verde para {self.agent.green_time_duration}s")
-
-                # Decide se inicia a transição para a próxima fase:
-                # - Se passou o tempo mínimo E outra fase tem demanda significativamente maior
-                # - Ou se atingiu o tempo máximo planejado para esta fase
-                demand_threshold_factor = 1.25
-                if ((time_on_phase >= self.agent.min_green and best_phase != current_phase and best_phase_demand > current_phase_demand * demand_threshold_factor)
-                        or (time_on_phase >= self.agent.green_time_duration)):
-                    # Inicia a transição (normalmente a fase seguinte é o amarelo)
-                    next_phase = (current_phase + 1) % len(phases)
-                    traci.trafficlight.setPhase(tls_id, next_phase)
-                    self.agent.current_phase_start_time = current_time  # Reset do timer
-                    #print(f"[{self.agent.name}] MUDANÇA: Verde -> Amarelo. Próximo verde alvo: {self.agent.green_time_duration}s")
-
-            # 2. Lógica para as Fases AMARELO (Yellow)
-            elif "y" in phases[current_phase].state or "Y" in phases[current_phase].state: # se amarelo atual
-                # O amarelo deve durar um tempo fixo
-                if time_on_phase >= self.agent.yellow_time:
-
-                    # Próxima fase deve ser o VERMELHO para a direção atual
-                    next_phase = (current_phase + 1) % len(phases)
-                    traci.trafficlight.setPhase(tls_id, next_phase)
-                    self.agent.current_phase_start_time = current_time # Reset do timer
-                    #print(f"[{self.agent.name}] MUDANÇA: Amarelo -> Próximo. Nova fase: {next_phase}")
-
-            # 3. Lógica para as Fases de TRANSIÇÃO/VERMELHO
-            else:
-                # Usa um tempo fixo (pode ser o mesmo que o amarelo)
-                transition_time = self.agent.red_time
-
-                if time_on_phase >= transition_time:
-
-                    # Próxima fase (deve ser o próximo verde)
-                    next_phase = (current_phase + 1) % len(phases)
-                    traci.trafficlight.setPhase(tls_id, next_phase)
-                    self.agent.current_phase_start_time = current_time # Reset do timer
-                    #print(f"[{self.agent.name}] MUDANÇA: Transição/Vermelho -> Próximo. Nova fase: {next_phase}")
-
-            '''
-            # Lógica adaptativa simples
-            # Se houver muito trânsito, mantém verde por mais tempo
-            if total_vehicles > 10 and self.agent.green_time < self.agent.max_green:
-                self.agent.green_time += 2
-                print(f"[{self.agent.name}] Estendendo verde para {self.agent.green_time}s")
-            elif total_vehicles < 3 and self.agent.green_time > self.agent.min_green:
-                self.agent.green_time -= 1
-                print(f"[{self.agent.name}] Reduzindo verde para {self.agent.green_time}s")
-
-            # Simples mudança de fase (podes adaptar depois)
-            if traci.simulation.getTime() % self.agent.green_time == 0:
-                next_phase = (current_phase + 1) % len(phases)
-                traci.trafficlight.setPhase(tls_id, next_phase)
-                print(f"[{self.agent.name}] Mudança de fase para {next_phase}")
-            '''
 
-            print(f"[{self.agent.name}] Finalizando comportamento.")
+            # Totais só calculados e formatados quando o debug está activo
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[%s] Veh=%d wait=%.2f phase=%d t=%.1f", self.agent.name,
+                             lane_vehicles.sum(), lane_waiting.mean() if len(lane_waiting) else 0.0,
+                             current_phase, time_on_phase)
+
+            # Decisão puramente numérica (sem TraCI), em decide_next_phase
+            next_phase, agent.green_time_duration = decide_next_phase(
+                agent.green_mask, lane_vehicles, lane_halting, lane_waiting, agent.phase_tau, agent.phase_kind,
+                current_phase, time_on_phase, agent.green_time_duration,
+                agent.min_green, agent.max_green, agent.yellow_time, agent.red_time,
+                agent.discharge_time)
+
+            if next_phase != current_phase:
+                traci.trafficlight.setPhase(tls_id, next_phase)
+                agent.current_phase_start_time = current_time  # Reset do timer
+                logger.debug("[%s] MUDANÇA: %d -> %d. Verde alvo: %ss", agent.name,
+                             current_phase, next_phase, agent.green_time_duration)
+            agent.current_phase = next_phase
 
     class ListenPriorityBehaviour(behaviour.CyclicBehaviour):
         async def run(self):
             msg = await self.receive(timeout=0.1)
-            if msg and msg.body and "priority_request" in msg.body:
+            if msg and msg.body and msg.body.startswith("priority_request:"):
                 try:
                     content = msg.body
                     if ":" in content:
-                        veh_id = content.split(":")[1]
-                        if str(veh_id) in traci.vehicle.getIDList():
-                            lane_id = traci.vehicle.getLaneID(veh_id)
+                        veh_id = content.split(":", 2)[1]
+                        if veh_id in WORLD.vehicle_ids:
+                            # Lane subscrita no WORLD; só pergunta ao SUMO antes da primeira leitura
+                            lane_id = WORLD.vehicle_vars.get(veh_id, {}).get(tc.VAR_LANE_ID)
+                            if lane_id is None:
+                                lane_id = traci.vehicle.getLaneID(veh_id)
                             tls_id = self.agent.tls_id
                             
-                            # Correctly map lane to signal indices using getControlledLinks
-                            links = traci.trafficlight.getControlledLinks(tls_id)
-                            # links is a list of lists: indices correspond to phase.state characters
-                            
-                            target_indices = []
-                            for i, link_list in enumerate(links):
-                                # check connections commanded by signal i
-                                for connection in link_list:
-                                    # connection is (incoming_lane, outgoing_lane, via_lane)
-                                    # we check if incoming_lane matches our ambulance lane
-                                    if connection[0] == lane_id:
-                                        target_indices.append(i)
-                                        break # found a match for this signal index
+                            # signals commanding the ambulance lane, mapped once in load_program
+                            target_bits = self.agent.lane_signal_bits.get(lane_id, 0)
                             
-                            if target_indices:
-                                with warnings.catch_warnings():
-                                    warnings.simplefilter("ignore")
-                                    logic = traci.trafficlight.getCompleteRedYellowGreenDefinition(tls_id)[0]
-                                phases = logic.getPhases()
+                            if target_bits:
+                                # First phase where our lane has Green: one AND per phase
+                                best_phase = next(
+                                    (p_idx for p_idx, bits in enumerate(self.agent.green_bits) if bits & target_bits), -1)
                                 
-                                best_phase = -1
-                                for p_idx, phase in enumerate(phases):
-                                    # Find first phase where our lane has Green
-                                    is_green = False
-                                    for t_idx in target_indices:
-                                        if len(phase.state) > t_idx and phase.state[t_idx] in ('G', 'g'):
-                                            is_green = True
-                                            break
-                                    
-                                    if is_green:
-                                        best_phase = p_idx
-                                        break
-                                
-                                current_phase = traci.trafficlight.getPhase(tls_id)
+                                current_phase = self.agent.phase_now()
                                 if best_phase != -1 and best_phase != current_phase:
                                     traci.trafficlight.setPhase(tls_id, best_phase)
-                                    self.agent.current_phase_start_time = traci.simulation.getTime()
-                                    print(f"[{self.agent.name}] PRIORITY: Ambulancia {veh_id}. MUDANCA DE FASE IMEDIATA -> {best_phase}")
+                                    self.agent.current_phase_start_time = WORLD.time
+                                    self.agent.current_phase = best_phase
+                                    logger.info("[%s] PRIORITY: Ambulancia %s. MUDANCA DE FASE IMEDIATA -> %s", self.agent.name, veh_id, best_phase)
                 except Exception as e:
-                    print(f"[{self.agent.name}] Error handling priority: {e}")
+                    logger.warning("[%s] Error handling priority: %s", self.agent.name, e)
 
     async def setup(self):
         """Inicialização do agente SPADE"""
         print(f"[{self.jid}] Agente de Semáforo iniciado (controlando {self.tls_id})")
 
         # Adiciona o comportamento de controlo principal
-        control_behaviour = self.ControlBehaviour(period=2)
+        # Acorda a cada passo de simulação; a cadência das decisões é em tempo de simulação
+        control_behaviour = self.ControlBehaviour()
         self.add_behaviour(control_behaviour)
 
         # Adiciona o comportamento de envio de relatórios
@@ -257,26 +343,114 @@ class TrafficLightAgent(agent.Agent):
         self.max_green = 20
         self.yellow_time = 4 # Tempo fixo para a fase amarela
         self.red_time = 4 # Tempo fixo para a fase vermelho
+        self.discharge_time = 2.0 # Tempo por veículo para escoar a fila (s)
 
         # Variáveis de estado
-        self.current_phase_start_time = 0.0 # Inicializa com um valor
-
         # Garante que o agente inicia com a hora correta da primeira fase
-        try:
-             self.current_phase_start_time = traci.simulation.getTime()
-        except traci.exceptions.TraCIException:
-             pass
+        # (tempo subscrito no WORLD, sem pedido ao SUMO)
+        self.current_phase_start_time = WORLD.time
+        # Última fase conhecida, actualizada pelo ControlBehaviour e lida pelo relatório
+        # (None até ao primeiro ciclo de controlo)
+        self.current_phase = None
+        # Tempo de simulação do último ciclo de controlo
+        self.last_control_time = None
+
+        # Lanes controladas (fixas): lidas uma vez e registadas no TrafficManager, que as
+        # subscreve para o número de veículos e o tempo de espera
+        self.controlled_lanes = ()
+        if traci.isLoaded():
+            self.controlled_lanes = tuple(traci.trafficlight.getControlledLanes(self.tls_id))
+            TRAFFIC.register(self.tls_id, self.controlled_lanes)
+            WORLD.require_tls((self.tls_id,), TLS_VARS)
+            WORLD.require(VEHICLE_VARS)
+        self.load_program()
+
+    def phase_now(self):
+        """
+        Fase actual do semáforo, da subscrição no WORLD. Se o próprio agente mudou a
+        fase neste passo, a subscrição ainda tem a anterior: vale a que ele definiu.
+        """
+        if self.current_phase is not None and self.current_phase_start_time == WORLD.time:
+            return self.current_phase
+        phase = WORLD.tls_vars.get(self.tls_id, {}).get(tc.TL_CURRENT_PHASE)
+        if phase is None:
+            phase = traci.trafficlight.getPhase(self.tls_id)
+        return phase
+
+    def load_program(self):
+        """
+        Lê o programa de fases do semáforo uma vez e pré-calcula, por fase:
+        - green_mask: (fases x lanes controladas) 1.0 onde a lane tem verde
+        - phase_kind: tipo da fase (PHASE_GREEN / PHASE_YELLOW / PHASE_RED)
+        - phase_tau: (fases x fases) tempo de transição da fase atual (linha) até cada fase
+          (coluna): a soma dos tempos que o controlo mantém as fases amarelo / vermelho
+          pelo caminho (yellow_time / red_time), pela ordem do ciclo; 0 na diagonal
+        - green_bits: bit i de cada fase ligado quando o sinal i tem verde (pedidos de prioridade)
+
+        e, por lane de entrada, lane_signal_bits: bit i ligado quando o sinal i comanda
+        uma ligação a partir dessa lane (a topologia é fixa, getControlledLinks só aqui).
+        """
+        self.phases = ()
+        self.green_bits = ()
+        self.lane_signal_bits = {}
+        self.green_mask = np.zeros((0, len(self.controlled_lanes)))
+        self.phase_kind = np.zeros(0, dtype=np.int8)
+        self.phase_tau = np.zeros((0, 0))
+        if not traci.isLoaded():
+            return
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            logic = traci.trafficlight.getCompleteRedYellowGreenDefinition(self.tls_id)[0]
+        self.phases = tuple(logic.getPhases())
+
+        # getControlledLinks: uma lista por sinal (índice = char de phase.state) de
+        # ligações (incoming_lane, outgoing_lane, via_lane)
+        for i, link_list in enumerate(traci.trafficlight.getControlledLinks(self.tls_id)):
+            for incoming_lane in {connection[0] for connection in link_list}:
+                self.lane_signal_bits[incoming_lane] = self.lane_signal_bits.get(incoming_lane, 0) | (1 << i)
+
+        # A string phase.state tem um char por lane na mesma ordem de controlled_lanes
+        n_lanes = len(self.controlled_lanes)
+        self.green_mask = np.array(
+            [[lane_idx < len(phase.state) and phase.state[lane_idx] in ("g", "G") for lane_idx in range(n_lanes)]
+             for phase in self.phases],
+            dtype=np.float64).reshape(len(self.phases), n_lanes)
+        self.phase_kind = np.array(
+            [PHASE_GREEN if ("g" in p.state or "G" in p.state)
+             else PHASE_YELLOW if ("y" in p.state or "Y" in p.state)
+             else PHASE_RED
+             for p in self.phases],
+            dtype=np.int8)
+        # int do Python (sem limite de 64 sinais): bit i = char i de phase.state
+        self.green_bits = tuple(
+            sum(1 << i for i, c in enumerate(p.state) if c in ("g", "G")) for p in self.phases)
+        # O controlo avança sempre para a fase seguinte: de c até p passa-se por todas as
+        # fases intermédias, e só as de transição (não verdes) custam tempo: o que os
+        # handlers lhes dão (yellow_time / red_time), não a duração no programa do SUMO
+        n_phases = len(self.phases)
+        transition_time = {PHASE_GREEN: 0.0, PHASE_YELLOW: float(self.yellow_time),
+                           PHASE_RED: float(self.red_time)}
+        transition = [transition_time[int(kind)] for kind in self.phase_kind]
+        self.phase_tau = np.zeros((n_phases, n_phases))
+        for c in range(n_phases):
+            elapsed = 0.0
+            for step in range(1, n_phases):
+                p = (c + step) % n_phases
+                self.phase_tau[c, p] = elapsed
+                elapsed += transition[p]
 
     def set_manual_phase(self, phase_index):
         """força manualmente uma fase"""
         if not traci.isLoaded():
-            print(f"[{self.jid}] Cannot set phase: SUMO not loaded")
+            logger.warning("[%s] Cannot set phase: SUMO not loaded", self.jid)
             return
             
         try:
             traci.trafficlight.setPhase(self.tls_id, phase_index)
-            self.current_phase_start_time = traci.simulation.getTime()
-            print(f"[{self.tls_id}] Manually set to phase {phase_index}")
+            self.current_phase_start_time = WORLD.time
+            self.current_phase = phase_index
+            logger.info("[%s] Manually set to phase %s", self.tls_id, phase_index)
         except Exception as e:
-            print(f"[{self.tls_id}] Error setting manual phase: {e}")
+            logger.warning("[%s] Error setting manual phase: %s", self.tls_id, e)
 
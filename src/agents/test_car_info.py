@@ -0,0 +1,293 @@
+"""
+Testes do CarInfoAgent: subscrições e remoção de veículos contra o SUMO, e a cache
+de rotas partilhada (rede e viagens em sumo_environment)
+
+Execução:
+    pytest src/agents/test_car_info.py -v
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip("spade")
+
+import traci.constants as tc
+from utils.traci_compat import traci
+from utils.WorldSnapshot import WorldSnapshot
+from agents.CarInfo import CarInfoAgent
+
+SUMO_CFG = os.path.join(os.path.dirname(__file__), '../../sumo_environment/map.sumocfg')
+
+needs_sumo = pytest.mark.skipif(shutil.which("sumo") is None, reason="SUMO não instalado")
+
+
+@pytest.fixture
+def sumo(monkeypatch):
+    """
+    Simulação headless da rede do projecto, fechada no fim do teste com os step listeners
+    que o teste registou (o libsumo mantém-nos depois do close e passariam ao teste seguinte).
+    """
+    traci.start(["sumo", "-c", SUMO_CFG, "--no-step-log", "--no-warnings"])
+    listener_ids = []
+    add_step_listener = traci.addStepListener
+
+    def add_and_record(listener):
+        listener_id = add_step_listener(listener)
+        listener_ids.append(listener_id)
+        return listener_id
+
+    monkeypatch.setattr(traci, "addStepListener", add_and_record)
+    yield
+    for listener_id in listener_ids:
+        traci.removeStepListener(listener_id)
+    traci.close()
+
+
+@needs_sumo
+def test_vehicle_variables_can_be_subscribed(sumo):
+    """Todas as variáveis de CarInfoAgent.VEHICLE_VARIABLES são subscritas nos veículos que partem"""
+    world = WorldSnapshot()
+    world.install()
+    world.require(CarInfoAgent.VEHICLE_VARIABLES)
+
+    for _ in range(20):
+        traci.simulationStep()
+        if world.vehicle_vars:
+            break
+    assert world.vehicle_vars
+
+    for veh_id, data in world.vehicle_vars.items():
+        assert set(CarInfoAgent.VEHICLE_VARIABLES) <= data.keys()
+        # a rota é a tupla de edges, com a edge actual na posição VAR_ROUTE_INDEX
+        route = data[tc.VAR_EDGES]
+        assert route == traci.vehicle.getRoute(veh_id)
+        assert route[data[tc.VAR_ROUTE_INDEX]] == data[tc.VAR_ROAD_ID]
+
+
+@needs_sumo
+def test_despawn_before_closed_final_edge(sumo, monkeypatch):
+    """
+    Um veículo subscrito que se aproxima da edge final fechada é removido e a simulação
+    continua (com ARCANUM_USE_LIBSUMO=1 o passo seguinte falhava se continuasse subscrito)
+    """
+    import agents.CarInfo as car_info
+    world = WorldSnapshot()
+    monkeypatch.setattr(car_info, "WORLD", world)
+    world.install()
+    world.require(CarInfoAgent.VEHICLE_VARIABLES)
+
+    # primeiro veículo cuja próxima edge é a última da rota
+    cid = None
+    for _ in range(300):
+        traci.simulationStep()
+        for veh_id, data in world.vehicle_vars.items():
+            route, idx = data[tc.VAR_EDGES], data[tc.VAR_ROUTE_INDEX]
+            if idx >= 0 and idx + 2 == len(route):
+                cid = veh_id
+                break
+        if cid is not None:
+            break
+    assert cid is not None
+
+    agent = CarInfoAgent("car@localhost", "password", "monitor@localhost")
+    car_behaviour = CarInfoAgent.CarInfoBehaviour(period=CarInfoAgent.CAR_INFO_PERIOD)
+    car_behaviour.set_agent(agent)
+    agent.vehicle_id = cid
+    monkeypatch.setitem(CarInfoAgent.claimed_vehicles, cid, str(agent.jid))
+    monkeypatch.setattr(CarInfoAgent, "blocked_edges", frozenset({world.vehicle_vars[cid][tc.VAR_EDGES][-1]}))
+
+    car_behaviour.track_vehicle()
+    assert agent.vehicle_id is None
+    assert cid not in CarInfoAgent.claimed_vehicles
+
+    traci.simulationStep()
+    assert cid not in world.vehicle_ids
+
+
+@needs_sumo
+def test_load_edge_data_uses_route_finder_lanes(sumo, monkeypatch):
+    """As lanes e comprimentos lidos do RouteFinder coincidem com os do SUMO"""
+    import agents.CarInfo as car_info
+    world = WorldSnapshot()
+    monkeypatch.setattr(car_info, "WORLD", world)
+    for name, value in (("edge_index", {}), ("edge_lanes", {}), ("blocked_edges", frozenset()),
+                        ("route_cache", OrderedDict()), ("route_cache_by_edge", {}),
+                        ("route_requests", {}), ("route_solver", None)):
+        monkeypatch.setattr(CarInfoAgent, name, value)
+    world.install()
+    CarInfoAgent.load_edge_data()
+
+    normal_edges = [e for e in traci.edge.getIDList() if not e.startswith(":")]
+    assert set(CarInfoAgent.edge_index) == set(normal_edges)
+    for edge, i in CarInfoAgent.edge_index.items():
+        lanes = CarInfoAgent.edge_lanes[edge]
+        assert len(lanes) == traci.edge.getLaneNumber(edge)
+        assert CarInfoAgent.lane_ids[CarInfoAgent.lane_offsets[i]:][:len(lanes)] == lanes
+        assert CarInfoAgent.edge_length[i] == pytest.approx(traci.lane.getLength(lanes[0]))
+
+    # as permissões de todas as lanes chegam com o passo e nenhuma edge está fechada
+    traci.simulationStep()
+    for lane in CarInfoAgent.lane_ids:
+        assert tc.LANE_DISALLOWED in world.lane_vars[lane]
+    assert CarInfoAgent.blocked_edges == frozenset()
+
+
+@needs_sumo
+def test_reroute_falls_back_to_sumo_without_route_finder(sumo, monkeypatch):
+    """Sem RouteFinder (rede não lida) o agente arranca e o reroute passa para o rerouteTraveltime do SUMO"""
+    import agents.CarInfo as car_info
+
+    def broken_route_finder():
+        raise OSError("network.net.xml ilegível")
+
+    world = WorldSnapshot()
+    monkeypatch.setattr(car_info, "WORLD", world)
+    monkeypatch.setattr(car_info, "get_route_finder", broken_route_finder)
+    for name, value in (("edge_index", {}), ("edge_lanes", {}), ("blocked_edges", frozenset()),
+                        ("route_cache", OrderedDict()), ("route_cache_by_edge", {}),
+                        ("route_requests", {}), ("route_solver", None)):
+        monkeypatch.setattr(CarInfoAgent, name, value)
+    world.install()
+
+    agent = CarInfoAgent("car@localhost", "password", "monitor@localhost")
+    asyncio.run(agent.setup())
+    assert CarInfoAgent.edge_index
+
+    # primeiro veículo numa edge normal, ainda longe do destino
+    cid = None
+    for _ in range(100):
+        traci.simulationStep()
+        for veh_id, data in world.vehicle_vars.items():
+            road = data[tc.VAR_ROAD_ID]
+            if road and not road.startswith(":") and road != data[tc.VAR_EDGES][-1]:
+                cid = veh_id
+                break
+        if cid is not None:
+            break
+    assert cid is not None
+
+    rerouted = []
+    monkeypatch.setattr(car_info.traci.vehicle, "rerouteTraveltime",
+                        lambda veh_id, currentTravelTimes=True: rerouted.append(veh_id))
+    agent.vehicle_id = cid
+    agent.reroute_threshold_factor = 0.0  # qualquer tempo restante pede reroute
+    car_behaviour = CarInfoAgent.CarInfoBehaviour(period=CarInfoAgent.CAR_INFO_PERIOD)
+    car_behaviour.set_agent(agent)
+
+    asyncio.run(car_behaviour.check_reroute())
+    assert rerouted == [cid]
+    assert agent.rerouted_current
+
+
+@pytest.fixture
+def route_behaviour(monkeypatch):
+    """CarInfoBehaviour com a cache de rotas vazia e sem edges fechadas."""
+    monkeypatch.setattr(CarInfoAgent, "route_cache", OrderedDict())
+    monkeypatch.setattr(CarInfoAgent, "route_cache_by_edge", {})
+    monkeypatch.setattr(CarInfoAgent, "blocked_edges", frozenset())
+    monkeypatch.setattr(CarInfoAgent, "route_requests", {})
+    monkeypatch.setattr(CarInfoAgent, "route_solver", None)
+    agent = CarInfoAgent("car@localhost", "password", "monitor@localhost")
+    agent.route_cache_ttl = 60
+    car_behaviour = CarInfoAgent.CarInfoBehaviour(period=CarInfoAgent.CAR_INFO_PERIOD)
+    car_behaviour.set_agent(agent)
+    return car_behaviour
+
+
+def long_route_pairs(min_edges=4):
+    """(início, destino) com rota de pelo menos min_edges edges na rede do projecto"""
+    from agents.CarInfo import get_route_finder
+    route_finder = get_route_finder()
+    for start in route_finder.edges:
+        for dest in route_finder.edges:
+            if start != dest and len(route_finder.find_route(start, dest, False)) >= min_edges:
+                yield start, dest
+
+
+def assert_index_consistent():
+    """route_cache_by_edge indexa exactamente as rotas em cache, por cada edge que usam"""
+    cache, index = CarInfoAgent.route_cache, CarInfoAgent.route_cache_by_edge
+    for key, (_, route) in cache.items():
+        for edge in route:
+            assert key in index[edge]
+    for edge, keys in index.items():
+        for key in keys:
+            assert edge in cache[key][1]
+
+
+def test_route_cache_hits_and_suffixes(route_behaviour):
+    """Uma pesquisa guarda a rota e os seus sufixos; pedidos repetidos devolvem o mesmo tuplo"""
+    start, dest = next(long_route_pairs())
+    route = asyncio.run(route_behaviour.find_route_cached(start, dest))
+    assert route[0] == start and route[-1] == dest
+
+    for i in range(len(route) - 1):
+        assert CarInfoAgent.route_cache[(route[i], dest)][1] == route[i:]
+    assert asyncio.run(route_behaviour.find_route_cached(start, dest)) is route
+    assert_index_consistent()
+
+    # expirado o TTL, a rota é calculada de novo
+    route_behaviour.agent.route_cache_ttl = 0
+    again = asyncio.run(route_behaviour.find_route_cached(start, dest))
+    assert again == route and again is not route
+    assert_index_consistent()
+
+
+def test_closed_edge_evicts_routes_and_suffixes_through_it(route_behaviour):
+    """Fechar uma edge remove todas as rotas (e sufixos) em cache que a usam, e só essas"""
+    for start, dest in list(long_route_pairs())[:20]:
+        asyncio.run(route_behaviour.find_route_cached(start, dest))
+    route = CarInfoAgent.route_cache[next(iter(CarInfoAgent.route_cache))][1]
+    closed = route[len(route) // 2]
+    before = dict(CarInfoAgent.route_cache)
+
+    CarInfoAgent.invalidate_routes_through({closed})
+
+    for key, (_, cached) in before.items():
+        assert (key in CarInfoAgent.route_cache) == (closed not in cached)
+    assert not CarInfoAgent.route_cache_by_edge.get(closed)
+    assert_index_consistent()
+
+
+def test_route_cache_size_cap_keeps_index_consistent(route_behaviour, monkeypatch):
+    """Com o limite de tamanho, as rotas mais antigas saem da cache e do índice por edge"""
+    monkeypatch.setattr(CarInfoAgent, "route_cache_max_size", 5)
+    for start, dest in list(long_route_pairs())[:20]:
+        asyncio.run(route_behaviour.find_route_cached(start, dest))
+        assert len(CarInfoAgent.route_cache) <= 5
+        assert_index_consistent()
+
+
+def test_concurrent_misses_are_solved_in_one_batch(route_behaviour, monkeypatch):
+    """Pedidos em falta ao mesmo tempo vão numa só chamada a find_routes_many, sem pares repetidos"""
+    from agents.CarInfo import get_route_finder
+    route_finder = get_route_finder()
+    pairs = list(long_route_pairs())[:10]
+    batches = []
+    find_routes_many = route_finder.find_routes_many
+
+    def spy(batch, *args):
+        batches.append(list(batch))
+        return find_routes_many(batch, *args)
+
+    monkeypatch.setattr(route_finder, "find_routes_many", spy)
+
+    async def run():
+        # cada par pedido por dois agentes
+        return await asyncio.gather(*(route_behaviour.find_route_cached(start, dest)
+                                      for start, dest in pairs + pairs))
+
+    routes = asyncio.run(run())
+    assert batches == [pairs]
+    for (start, dest), route, again in zip(pairs, routes, routes[len(pairs):]):
+        assert route == tuple(route_finder.find_route(start, dest, False))
+        assert again is route
+    assert not CarInfoAgent.route_requests
+    assert_index_consistent()
@@ -0,0 +1,123 @@
+"""
+Testes unitários de decide_next_phase (núcleo numérico do TrafficLightAgent)
+
+Execução:
+    pytest src/agents/test_traffic_light.py -v
+"""
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip("spade")
+
+from agents.TrafficLightAgent import decide_next_phase, PHASE_GREEN, PHASE_YELLOW, PHASE_RED
+
+SUMO_CFG = os.path.join(os.path.dirname(__file__), '../../sumo_environment/map.sumocfg')
+
+needs_sumo = pytest.mark.skipif(shutil.which("sumo") is None, reason="SUMO não instalado")
+
+MIN_GREEN, MAX_GREEN = 5, 20
+YELLOW_TIME, RED_TIME = 4, 4
+DISCHARGE_TIME = 2.0
+
+# Programa de 4 fases sobre 2 lanes: verde lane 0, amarelo, verde lane 1, vermelho
+GREEN_MASK = np.array([[1.0, 0.0], [0.0, 0.0], [0.0, 1.0], [0.0, 0.0]])
+PHASE_KIND = np.array([PHASE_GREEN, PHASE_YELLOW, PHASE_GREEN, PHASE_RED], dtype=np.int8)
+# transições de 3 s (amarelo) e 2 s (vermelho) pela ordem do ciclo
+PHASE_TAU = np.array([[0.0, 0.0, 3.0, 3.0],
+                      [2.0, 0.0, 0.0, 0.0],
+                      [2.0, 5.0, 0.0, 0.0],
+                      [0.0, 3.0, 3.0, 0.0]])
+
+
+def decide(lane_vehicles, lane_halting, current_phase, time_on_phase, green_time_duration=10,
+           lane_waiting=(0.0, 0.0)):
+    return decide_next_phase(
+        GREEN_MASK, np.array(lane_vehicles, dtype=float), np.array(lane_halting, dtype=float),
+        np.array(lane_waiting, dtype=float), PHASE_TAU, PHASE_KIND,
+        current_phase, time_on_phase, green_time_duration,
+        MIN_GREEN, MAX_GREEN, YELLOW_TIME, RED_TIME, DISCHARGE_TIME)
+
+
+def test_green_switches_when_other_phase_has_much_higher_priority():
+    """Passado o min_green, uma fila muito maior na outra fase inicia o amarelo"""
+    assert decide([0, 8], [0, 8], current_phase=0, time_on_phase=MIN_GREEN) == (1, 10)
+
+
+def test_green_holds_before_min_green():
+    """Antes do min_green a fase verde mantém-se, mesmo com mais procura noutra fase"""
+    assert decide([0, 8], [0, 8], current_phase=0, time_on_phase=MIN_GREEN - 1) == (0, 10)
+
+
+def test_green_holds_below_threshold():
+    """Prioridade da outra fase abaixo de DEMAND_THRESHOLD_FACTOR vezes a atual: sem troca"""
+    assert decide([4, 4], [4, 4], current_phase=0, time_on_phase=MIN_GREEN) == (0, 10)
+
+
+def test_waiting_time_counts_towards_priority():
+    """Com filas iguais, o tempo de espera acumulado na outra fase força a troca"""
+    assert decide([4, 4], [4, 4], current_phase=0, time_on_phase=MIN_GREEN,
+                  lane_waiting=(0.0, 100.0)) == (1, 10)
+
+
+def test_green_ends_at_green_time_duration():
+    """Sem procura noutra fase, o verde acaba quando atinge o verde alvo"""
+    assert decide([5, 0], [0, 0], current_phase=0, time_on_phase=9) == (0, 10)
+    assert decide([5, 0], [0, 0], current_phase=0, time_on_phase=10) == (1, 10)
+
+
+def test_green_time_adapts_to_total_traffic():
+    """Verde alvo sobe com muito tráfego (até max_green) e desce com pouco (até min_green)"""
+    assert decide([12, 0], [0, 0], current_phase=0, time_on_phase=0)[1] == 12
+    assert decide([12, 0], [0, 0], current_phase=0, time_on_phase=0, green_time_duration=MAX_GREEN)[1] == MAX_GREEN
+    assert decide([0, 0], [0, 0], current_phase=0, time_on_phase=0, green_time_duration=MIN_GREEN)[1] == MIN_GREEN
+
+
+def test_yellow_holds_for_yellow_time():
+    """O amarelo dura yellow_time, qualquer que seja a procura"""
+    assert decide([0, 20], [0, 20], current_phase=1, time_on_phase=YELLOW_TIME - 1) == (1, 10)
+    assert decide([0, 0], [0, 0], current_phase=1, time_on_phase=YELLOW_TIME) == (2, 10)
+
+
+def test_red_holds_for_red_time():
+    """O vermelho dura red_time e depois volta ao início do ciclo"""
+    assert decide([20, 0], [20, 0], current_phase=3, time_on_phase=RED_TIME - 1) == (3, 10)
+    assert decide([0, 0], [0, 0], current_phase=3, time_on_phase=RED_TIME) == (0, 10)
+
+
+def test_empty_program_keeps_phase():
+    """Sem programa (SUMO não ligado) a fase e o verde alvo ficam iguais"""
+    result = decide_next_phase(
+        np.zeros((0, 0)), np.zeros(0), np.zeros(0), np.zeros(0), np.zeros((0, 0)),
+        np.zeros(0, dtype=np.int8), 0, 3.0, 10, MIN_GREEN, MAX_GREEN, YELLOW_TIME, RED_TIME, DISCHARGE_TIME)
+    assert result == (0, 10)
+
+
+@needs_sumo
+def test_phase_tau_uses_the_controller_transition_times():
+    """tau soma os yellow_time / red_time que os handlers mantêm, não as durações do programa do SUMO"""
+    from utils.traci_compat import traci
+    from agents.TrafficLightAgent import TrafficLightAgent
+    traci.start(["sumo", "-c", SUMO_CFG, "--no-step-log", "--no-warnings"])
+    try:
+        for tls_id in traci.trafficlight.getIDList():
+            agent = TrafficLightAgent(f"{tls_id}@localhost", "password", tls_id, "monitor@localhost")
+            agent.yellow_time, agent.red_time = 6, 7
+            agent.controlled_lanes = tuple(traci.trafficlight.getControlledLanes(tls_id))
+            agent.load_program()
+
+            hold = {PHASE_GREEN: 0, PHASE_YELLOW: 6, PHASE_RED: 7}
+            n = len(agent.phases)
+            for c in range(n):
+                for step in range(n):
+                    between = [(c + k) % n for k in range(1, step)]
+                    expected = sum(hold[int(agent.phase_kind[p])] for p in between)
+                    assert agent.phase_tau[c, (c + step) % n] == expected
+    finally:
+        traci.close()
@@ -1,6 +1,17 @@
 import tkinter as tk
 from tkinter import ttk
 import asyncio
+import time
+
+# Lanes offered when the DisruptionAgent has no lane_list (from the network file)
+DEFAULT_LANES = (
+    "E1_0", "E2_0", "E3_0", "E4_0", "E5_0", "E6_0",
+    "E7_0", "E8_0", "E9_0", "E10_0", "E11_0", "E12_0",
+    "E13_0", "E14_0", "E15_0", "E16_0",
+)
+PHASE_OPTIONS = tuple(str(i) for i in range(10))
+# Minimum wall-clock time (s) between Tk event pumps from the simulation loop (10 Hz)
+REFRESH_INTERVAL = 0.1
 
 class TrafficControlPanel:
     def __init__(self, master, disruption_agent, tls_agents):
@@ -13,6 +24,7 @@ class TrafficControlPanel:
 
         self.create_widgets()
         self.controls_enabled = False
+        self.last_refresh = 0.0
         self.disable_controls() # Start disabled until simulation runs
 
     def create_widgets(self):
@@ -24,11 +36,7 @@ class TrafficControlPanel:
         ttk.Label(disruption_frame, text="Select Lane ID:").grid(row=0, column=0, padx=5, pady=5)
         
         # Get lanes from agent if possible, otherwise hardcode default list from file
-        lane_options = getattr(self.disruption_agent, 'lane_list', [
-            "E1_0", "E2_0" , "E3_0", "E4_0", "E5_0", "E6_0", 
-            "E7_0", "E8_0", "E9_0", "E10_0", "E11_0", "E12_0",
-            "E13_0", "E14_0", "E15_0", "E16_0"
-        ])
+        lane_options = getattr(self.disruption_agent, 'lane_list', DEFAULT_LANES)
         
         self.lane_var = tk.StringVar()
         self.lane_combo = ttk.Combobox(disruption_frame, textvariable=self.lane_var, values=lane_options)
@@ -52,7 +60,7 @@ class TrafficControlPanel:
 
         # TLS Selection
         ttk.Label(tls_frame, text="Select Junction:").grid(row=0, column=0, padx=5, pady=5)
-        tls_ids = list(self.tls_agents.keys())
+        tls_ids = tuple(self.tls_agents)
         self.tls_var = tk.StringVar()
         self.tls_combo = ttk.Combobox(tls_frame, textvariable=self.tls_var, values=tls_ids)
         self.tls_combo.grid(row=0, column=1, padx=5, pady=5)
@@ -62,7 +70,7 @@ class TrafficControlPanel:
         ttk.Label(tls_frame, text="Phase Index:").grid(row=1, column=0, padx=5, pady=5)
         # Assuming simple phases 0-3 for now, or we could fetch from agent dynamically if implemented
         self.phase_var = tk.StringVar()
-        self.phase_combo = ttk.Combobox(tls_frame, textvariable=self.phase_var, values=[str(i) for i in range(10)])
+        self.phase_combo = ttk.Combobox(tls_frame, textvariable=self.phase_var, values=PHASE_OPTIONS)
         self.phase_combo.grid(row=1, column=1, padx=5, pady=5)
         self.phase_combo.current(0)
 
@@ -86,6 +94,12 @@ class TrafficControlPanel:
         self.btn_phase.state(['disabled'])
 
     def update(self):
+        # Called once per simulation step: with a fast step rate, only repaint at
+        # REFRESH_INTERVAL instead of pumping the whole Tk queue every step
+        now = time.monotonic()
+        if now - self.last_refresh < REFRESH_INTERVAL:
+            return
+        self.last_refresh = now
         self.master.update()
 
     def trigger_disruption(self):
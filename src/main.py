@@ -1,4 +1,8 @@
-from time import sleep
+# O .env é carregado antes de qualquer import do projecto: utils.traci_compat escolhe
+# o backend (ARCANUM_USE_LIBSUMO) no momento em que é importado
+from dotenv import load_dotenv
+load_dotenv()
+
 from spade import agent
 from agents.TrafficLightAgent import TrafficLightAgent
 from agents.MonitoringAgent import MonitoringAgent
@@ -7,45 +11,64 @@ from agents.CarInfo import CarInfoAgent
 from agents.DisruptionAgent import DisruptionAgent
 from agents.AmbulanceManagerAgent import AmbulanceManagerAgent
 import asyncio
-import traci
+import atexit
+import logging
+import logging.handlers
+import queue
+from utils.traci_compat import traci, USE_LIBSUMO
+from utils.WorldSnapshot import WORLD
 import os
 import sys
 import tkinter as tk
 from gui import TrafficControlPanel
-from dotenv import load_dotenv
 
-load_dotenv()
+# Os agentes só põem o registo numa fila (QueueHandler); uma thread de fundo
+# (QueueListener) formata e escreve no terminal, fora do event loop dos agentes.
+# Mensagens de rotina dos agentes são DEBUG; LOG_LEVEL=DEBUG para as ver
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter("%(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_output)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# Os agentes de carro registam cada veículo reclamado/redireccionado: só avisos e erros
+# por omissão (CAR_LOG_LEVEL=INFO para os ver)
+logging.getLogger("agents.CarInfo").setLevel(os.getenv("CAR_LOG_LEVEL", "WARNING").upper())
+
+# Nomes das variáveis de credenciais dos agentes: 6 semáforos e 19 carros
+# (o 20.º carro fica para o Ambulance Manager)
+TL_CREDENTIAL_KEYS = tuple((f"TL_NAME_{i}", f"TL_PASSWORD_{i}") for i in range(1, 7))
+CAR_CREDENTIAL_KEYS = tuple((f"CAR_NAME_{i}", f"CAR_PASSWORD_{i}") for i in range(1, 20))
 
 
 async def main():
 
-    agent_name = os.getenv("AGENT_NAME")
-    agent_password = os.getenv("AGENT_PASSWORD")
-
-    # Load traffic light agent credentials
-    tl_agents_credentials = []
-    for i in range(1, 7):  # 6 traffic light agents
-        tl_name = os.getenv(f"TL_NAME_{i}")
-        tl_password = os.getenv(f"TL_PASSWORD_{i}")
-        if tl_name and tl_password:
-            tl_agents_credentials.append((tl_name, tl_password))
-
-    # Load car agent credentials
-    car_agents_credentials = []
-    # Use 19 car agents, save the 20th for Ambulance Manager
-    for i in range(1, 20):  
-        car_name = os.getenv(f"CAR_NAME_{i}")
-        car_password = os.getenv(f"CAR_PASSWORD_{i}")
-        if car_name and car_password:
-            car_agents_credentials.append((car_name, car_password))
+    # Uma só cópia do ambiente (já com o .env): as leituras seguintes são lookups num dict
+    env = dict(os.environ)
+
+    # Pausa (s de relógio) entre passos de simulação. 1 acompanha o tempo real
+    # (sumo-gui); 0 corre o mais depressa possível (headless)
+    step_delay = float(env.get("ARCANUM_STEP_DELAY", "1"))
+
+    agent_name = env.get("AGENT_NAME")
+    agent_password = env.get("AGENT_PASSWORD")
+
+    # Load traffic light and car agent credentials (pairs present in the environment)
+    tl_agents_credentials = [(env[name], env[password]) for name, password in TL_CREDENTIAL_KEYS
+                             if env.get(name) and env.get(password)]
+    car_agents_credentials = [(env[name], env[password]) for name, password in CAR_CREDENTIAL_KEYS
+                              if env.get(name) and env.get(password)]
     
     # Credentials for Ambulance Manager (using CAR 20)
-    amb_name = os.getenv("AMBULANCE_NAME")
-    amb_password = os.getenv("AMBULANCE_PASSWORD")
+    amb_name = env.get("AMBULANCE_NAME")
+    amb_password = env.get("AMBULANCE_PASSWORD")
 
     # Load disruption agent credentials
-    disruption_name = os.getenv("DISRUPTION_NAME")
-    disruption_password = os.getenv("DISRUPTION_PASSWORD")
+    disruption_name = env.get("DISRUPTION_NAME")
+    disruption_password = env.get("DISRUPTION_PASSWORD")
 
     # --- Path Setup for Robustness ---
     # 1. Get the directory of the current script (e.g., /ProjectRoot/src)
@@ -57,12 +80,13 @@ async def main():
 
     # 3. Construct the absolute path to the config file
     # This is equivalent to: /ProjectRoot/sumo_environment/map.sumocfg
-    CONFIG_FILE = os.path.join(PROJECT_ROOT, "sumo_environment", "map.sumocfg")
+    # (ARCANUM_SUMO_CFG aponta para outro .sumocfg, sem procurar no disco)
+    CONFIG_FILE = env.get("ARCANUM_SUMO_CFG") or os.path.join(PROJECT_ROOT, "sumo_environment", "map.sumocfg")
 
     # --- TraCI Setup ---
     # Optionally, add SUMO_HOME tools to path if you haven't globally
-    if 'SUMO_HOME' in os.environ:
-        tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    if 'SUMO_HOME' in env:
+        tools = os.path.join(env['SUMO_HOME'], 'tools')
         sys.path.append(tools)
     # else:
     #     # If you uncomment this, the script will stop if SUMO_HOME isn't set
@@ -75,9 +99,14 @@ async def main():
         sys.exit(1) # Exit the script
 
     # 5. Connect to SUMO simulation using the absolute path
-    # Use 'sumo-gui' instead of 'sumo' initially for visual debugging
+    # Headless 'sumo' by default; ARCANUM_SUMO_GUI=1 uses 'sumo-gui' for visual debugging
+    # (com ARCANUM_USE_LIBSUMO=1 o SUMO corre no próprio processo e não há GUI)
     # Add --ignore-route-errors para impedeir que o SUMO crash quando uma rota é fechada
-    traci.start(["sumo-gui", "-c", CONFIG_FILE, "--max-num-vehicles", str(20), "--ignore-route-errors"])
+    sumo_binary = "sumo-gui" if env.get("ARCANUM_SUMO_GUI") == "1" and not USE_LIBSUMO else "sumo"
+    traci.start([sumo_binary, "-c", CONFIG_FILE, "--max-num-vehicles", str(20), "--ignore-route-errors"])
+
+    # Estado partilhado da simulação, actualizado uma vez por passo para todos os agentes
+    WORLD.install()
 
     # --- Inicializar GUI ---
     root = tk.Tk()
@@ -129,19 +158,15 @@ async def main():
     panel = TrafficControlPanel(root, disruption_agent, tls_agents)
 
 
-    # Criar agente
-    await monitor_agent.start()
-
-    await disruption_agent.start()
-    
-    for tls_agent in tls_agents:
-        await tls_agent.start()
-    
-    for car_agent in car_agents:
-        await car_agent.start()
-
+    # Iniciar todos os agentes em paralelo: cada start() faz o login XMPP, e as
+    # esperas pelo servidor sobrepõem-se em vez de se somarem
+    all_agents = [monitor_agent, disruption_agent, *tls_agents, *car_agents]
     if ambulance_agent:
-        await ambulance_agent.start()
+        all_agents.append(ambulance_agent)
+    results = await asyncio.gather(*(a.start() for a in all_agents), return_exceptions=True)
+    for a, result in zip(all_agents, results):
+        if isinstance(result, Exception):
+            print(f"Erro ao iniciar {a.jid}: {result}")
 
     panel.enable_controls()
 
@@ -154,28 +179,24 @@ async def main():
              print("Painel fechado.")
              break
         traci.simulationStep()
-        await asyncio.sleep(1)
+        # Sem veículos em simulação nem por partir: a simulação acabou
+        if WORLD.min_expected <= 0:
+            print("Simulação terminada: sem veículos.")
+            break
+        # ARCANUM_STEP_DELAY=0: sem pausa, só devolve o controlo aos agentes
+        await asyncio.sleep(step_delay)
 
     # --- Encerrar ---
-    await monitor_agent.stop()
-    print("Monitor agent encerrado.")
-    
-    await disruption_agent.stop()
-    print("Disruption agent encerrado.")
-
-    for tls_agent in tls_agents:
-        await tls_agent.stop()
-    print(f"{len(tls_agents)} TL agents encerrados.")
-    
-    for car_agent in car_agents:
-        await car_agent.stop()
-    print(f"{len(car_agents)} Car agents encerrados.")
-
-    if ambulance_agent:
-        await ambulance_agent.stop()
-        print("Ambulance Manager encerrado.")
+    await asyncio.gather(*(a.stop() for a in all_agents), return_exceptions=True)
+    print(f"{len(all_agents)} agentes encerrados ({len(tls_agents)} TL, {len(car_agents)} Car).")
     
     traci.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop (event loop em C, libuv) quando disponível; não existe no Windows
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
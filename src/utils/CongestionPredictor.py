@@ -1,22 +1,33 @@
 """
 CongestionPredictor - Modelo de Machine Learning para previsão de congestionamento
 
-Este módulo implementa um modelo de Regressão Logística para prever a probabilidade
-de congestionamento baseado em métricas de tráfego em tempo real.
+Este módulo implementa um modelo de Regressão Logística (treinado por SGD, de forma
+incremental) para prever a probabilidade de congestionamento baseado em métricas de tráfego em tempo real.
 """
 
+import joblib
 import numpy as np
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import SGDClassifier
 from sklearn.preprocessing import StandardScaler
-import traci
+try:
+    from utils.traci_compat import traci
+except ImportError:  # importado directamente de src/utils (e.g. nos testes)
+    from traci_compat import traci
+import traci.constants as tc
 from typing import List, Tuple, Optional
 import warnings
+import copy
 import json
+import logging
+import math
 import pickle
 import os
+import xml.etree.ElementTree as ET
 
 warnings.filterwarnings('ignore')
 
+logger = logging.getLogger(__name__)
+
 
 class CongestionPredictor:
     """
@@ -32,8 +43,20 @@ class CongestionPredictor:
     - is_congested: 1 se congestionado, 0 caso contrário
     """
     
+    # Número de features por amostra e capacidade inicial do buffer de amostras
+    N_FEATURES = 4
+    INITIAL_CAPACITY = 256
+    # Classes do modelo (partial_fit precisa de as conhecer desde o primeiro lote)
+    CLASSES = np.array([0, 1])
+
+    @staticmethod
+    def _new_model() -> SGDClassifier:
+        """Regressão logística treinada por SGD (log_loss), com suporte a partial_fit."""
+        return SGDClassifier(loss='log_loss', learning_rate='adaptive', eta0=0.01, random_state=42)
+    
     def __init__(self, congestion_threshold: float = 5.0, min_samples_to_train: int = 50, 
-                 data_dir: str = "ml_data"):
+                 data_dir: str = "ml_data", network_length: Optional[float] = None,
+                 net_file: Optional[str] = None):
         """
         Inicializa o preditor.
         
@@ -41,19 +64,28 @@ class CongestionPredictor:
             congestion_threshold: Velocidade média abaixo da qual considera-se congestionamento (m/s)
             min_samples_to_train: Número mínimo de amostras antes de treinar o modelo
             data_dir: Diretório para salvar/carregar dados persistentes
+            network_length: Comprimento total da rede (m); se None é calculado na primeira amostra
+            net_file: Ficheiro .net.xml de onde ler o comprimento da rede (sem pedidos TraCI);
+                      se None ou ilegível, o comprimento é pedido ao TraCI
         """
-        self.model = LogisticRegression(random_state=42, max_iter=1000)
+        self.model = self._new_model()
         self.scaler = StandardScaler()
+        self.linear = None  # (média, escala, pesos, intercept), preenchido por _set_model
         self.congestion_threshold = congestion_threshold
         self.min_samples_to_train = min_samples_to_train
         self.data_dir = data_dir
+        self.net_file = net_file
         
         # Criar diretório de dados se não existir
         os.makedirs(self.data_dir, exist_ok=True)
         
-        # Armazenamento de dados para treinamento
-        self.training_features: List[List[float]] = []
-        self.training_labels: List[int] = []
+        # Armazenamento de dados para treinamento: arrays pré-alocados (uma linha por
+        # amostra) que dobram de tamanho quando enchem; só as primeiras n_samples são válidas
+        self._features = np.empty((self.INITIAL_CAPACITY, self.N_FEATURES), dtype=np.float64)
+        self._labels = np.empty(self.INITIAL_CAPACITY, dtype=np.int8)
+        self.n_samples = 0
+        # Amostras já vistas pelo modelo (o treino seguinte só usa as restantes)
+        self.trained_samples = 0
         
         # Estado do modelo
         self.is_trained = False
@@ -61,7 +93,7 @@ class CongestionPredictor:
         self.total_trainings = 0
         
         # Cache para cálculo de densidade
-        self.total_network_length: Optional[float] = None
+        self.total_network_length: Optional[float] = network_length
         
         # Tentar carregar dados persistentes
         self.load_data()
@@ -71,22 +103,48 @@ class CongestionPredictor:
         Calcula o comprimento total da rede (em metros).
         Cacheia o resultado para evitar recalcular.
         """
+        if self.total_network_length is None and self.net_file is not None:
+            try:
+                self.total_network_length = self._net_file_length(self.net_file)
+            except Exception as e:
+                logger.warning("[Predictor] Erro ao ler %s (%s), a usar o TraCI", self.net_file, e)
         if self.total_network_length is None:
             try:
+                # traci.edge não tem getLength: usa o comprimento da primeira lane de cada edge
                 edge_ids = traci.edge.getIDList()
                 self.total_network_length = sum(
-                    traci.edge.getLength(edge_id) for edge_id in edge_ids
+                    traci.lane.getLength(f"{edge_id}_0") for edge_id in edge_ids
                 )
             except Exception as e:
-                print(f"[Predictor] Erro ao calcular comprimento da rede: {e}")
+                logger.warning("[Predictor] Erro ao calcular comprimento da rede: %s", e)
                 self.total_network_length = 10000.0  # Valor padrão de 10km
         
         return self.total_network_length
     
-    def collect_features(self) -> Optional[Tuple[List[float], int]]:
+    @staticmethod
+    def _net_file_length(net_file: str) -> float:
+        """
+        Soma o comprimento da primeira lane de cada edge normal (sem as internas das
+        junções) do ficheiro .net.xml.
+        """
+        total = 0.0
+        for _, elem in ET.iterparse(net_file, events=('end',)):
+            if elem.tag == 'edge':
+                lane = elem.find('lane')
+                if elem.get('function') != 'internal' and lane is not None:
+                    total += float(lane.get('length'))
+                elem.clear()
+        return total
+    
+    def collect_features(self, speeds: Optional[List[float]] = None) -> Optional[Tuple[List[float], int]]:
         """
         Coleta features da simulação SUMO atual.
         
+        Args:
+            speeds: Velocidades de todos os veículos (lista ou array NumPy, e.g. vindas de
+                    uma subscrição TraCI). Se None, são lidas dos resultados das subscrições
+                    de veículos (se incluírem VAR_SPEED) ou, sem subscrição, veículo a veículo.
+        
         Returns:
             Tupla (features, label) ou None se não houver dados suficientes
             - features: [num_vehicles, avg_speed, speed_variance, vehicle_density]
@@ -96,17 +154,23 @@ class CongestionPredictor:
             return None
         
         try:
-            vehicle_ids = traci.vehicle.getIDList()
-            num_vehicles = len(vehicle_ids)
+            # Coletar velocidades
+            if speeds is None:
+                speeds = self._subscribed_speeds()
+            if speeds is None:
+                speeds = [traci.vehicle.getSpeed(veh_id) for veh_id in traci.vehicle.getIDList()]
+            num_vehicles = len(speeds)
             
             # Precisa de pelo menos 1 veículo para calcular features
             if num_vehicles == 0:
                 return None
             
-            # Coletar velocidades
-            speeds = [traci.vehicle.getSpeed(veh_id) for veh_id in vehicle_ids]
-            avg_speed = np.mean(speeds)
-            speed_variance = np.var(speeds)
+            # converte uma única vez (np.mean/np.var converteriam uma lista cada um)
+            speeds = np.asarray(speeds, dtype=np.float64)
+            # média e variância da soma e da soma dos quadrados: Var = E[X²] - E[X]²
+            # (max com 0 absorve o erro de arredondamento quando as velocidades são iguais)
+            avg_speed = speeds.sum() / num_vehicles
+            speed_variance = max(speeds.dot(speeds) / num_vehicles - avg_speed * avg_speed, 0.0)
             
             # Calcular densidade (veículos por km)
             network_length_km = self._get_network_length() / 1000.0
@@ -126,19 +190,66 @@ class CongestionPredictor:
             return (features, is_congested)
             
         except Exception as e:
-            print(f"[Predictor] Erro ao coletar features: {e}")
+            logger.warning("[Predictor] Erro ao coletar features: %s", e)
             return None
     
+    def _subscribed_speeds(self) -> Optional[np.ndarray]:
+        """
+        Velocidades lidas da cache de subscrições do cliente TraCI (sem pedidos ao SUMO).
+        Devolve None se os veículos não estiverem todos subscritos com VAR_SPEED.
+        """
+        results = traci.vehicle.getAllSubscriptionResults()
+        if not results or traci.vehicle.getIDCount() != len(results):
+            return None
+        if not all(tc.VAR_SPEED in r for r in results.values()):
+            return None
+        return np.fromiter((r[tc.VAR_SPEED] for r in results.values()),
+                           dtype=np.float64, count=len(results))
+
+    @property
+    def training_features(self) -> np.ndarray:
+        """Features das amostras coletadas (vista n_samples x N_FEATURES, sem cópia)."""
+        return self._features[:self.n_samples]
+
+    @property
+    def training_labels(self) -> np.ndarray:
+        """Labels das amostras coletadas (vista, sem cópia)."""
+        return self._labels[:self.n_samples]
+
+    def _set_samples(self, features, labels) -> None:
+        """Substitui as amostras (e.g. ao carregar dados persistentes)."""
+        features = np.asarray(features, dtype=np.float64).reshape(-1, self.N_FEATURES)
+        n = len(features)
+        capacity = max(self.INITIAL_CAPACITY, n)
+        self._features = np.empty((capacity, self.N_FEATURES), dtype=np.float64)
+        self._labels = np.empty(capacity, dtype=np.int8)
+        self._features[:n] = features
+        self._labels[:n] = labels
+        self.n_samples = n
+
     def add_sample(self, features: List[float], label: int) -> None:
         """
         Adiciona uma amostra ao dataset de treinamento.
         
+        Escreve uma linha nos arrays pré-alocados; quando enchem, são copiados para
+        arrays com o dobro da capacidade. As linhas já escritas nunca mudam, por isso
+        um train() a correr noutra thread pode usar vistas sem copiar.
+        
         Args:
             features: Lista de features
             label: Label (0 ou 1)
         """
-        self.training_features.append(features)
-        self.training_labels.append(label)
+        n = self.n_samples
+        if n == len(self._labels):
+            features_buf = np.empty((2 * n, self.N_FEATURES), dtype=np.float64)
+            labels_buf = np.empty(2 * n, dtype=np.int8)
+            features_buf[:n] = self._features[:n]
+            labels_buf[:n] = self._labels[:n]
+            self._features, self._labels = features_buf, labels_buf
+        self._features[n] = features
+        self._labels[n] = label
+        # só depois de escrita a linha fica visível para train()/save_data()
+        self.n_samples = n + 1
         self.total_samples_collected += 1
     
     def should_train(self) -> bool:
@@ -148,12 +259,20 @@ class CongestionPredictor:
         Returns:
             True se houver amostras suficientes para treinar
         """
-        return len(self.training_features) >= self.min_samples_to_train
+        return self.n_samples >= self.min_samples_to_train
     
     def train(self) -> bool:
         """
         Treina o modelo com as amostras coletadas.
         
+        O primeiro treino usa todas as amostras; os seguintes actualizam o modelo e o
+        scaler com partial_fit só com as amostras novas, e o custo deixa de crescer
+        com o histórico.
+        
+        Pode correr numa thread (e.g. via run_in_executor) enquanto o event loop
+        continua a chamar add_sample/predict: treina cópias do modelo e do scaler,
+        que só substituem os actuais no fim.
+        
         Returns:
             True se o treinamento foi bem-sucedido
         """
@@ -161,27 +280,41 @@ class CongestionPredictor:
             return False
         
         try:
-            X = np.array(self.training_features)
-            y = np.array(self.training_labels)
+            # vistas das primeiras n amostras: add_sample só escreve depois delas
+            n = self.n_samples
+            X = self._features[:n]
+            y = self._labels[:n]
             
-            # Verificar se há pelo menos 2 classes
-            unique_labels = np.unique(y)
-            if len(unique_labels) < 2:
-                print(f"[Predictor] Aviso: Apenas uma classe presente nos dados ({unique_labels}). Aguardando mais variabilidade.")
-                return False
-            
-            # Normalizar features
-            X_scaled = self.scaler.fit_transform(X)
-            
-            # Treinar modelo
-            self.model.fit(X_scaled, y)
+            if self.is_trained and hasattr(self.model, 'partial_fit'):
+                # Treino incremental: só as amostras novas desde o último treino
+                start = self.trained_samples
+                if start >= n:
+                    return False
+                X_new, y_new = X[start:], y[start:]
+                scaler = copy.deepcopy(self.scaler).partial_fit(X_new)
+                model = copy.deepcopy(self.model)
+                model.partial_fit(scaler.transform(X_new), y_new, classes=self.CLASSES)
+            else:
+                # Primeiro treino (ou modelo antigo sem partial_fit): todas as amostras
+                # Verificar se há pelo menos 2 classes
+                unique_labels = np.unique(y)
+                if len(unique_labels) < 2:
+                    logger.info("[Predictor] Aviso: Apenas uma classe presente nos dados (%s). Aguardando mais variabilidade.", unique_labels)
+                    return False
+                
+                # Normalizar features
+                scaler = StandardScaler()
+                X_scaled = scaler.fit_transform(X)
+                
+                # Treinar modelo
+                model = self._new_model()
+                model.fit(X_scaled, y)
+            self._set_model(scaler, model)
+            self.trained_samples = n
             self.is_trained = True
             self.total_trainings += 1
             
-            # Manter todos os dados coletados (sem limitação)
-            # Nota: Em execuções muito longas, considere adicionar um limite maior se necessário
-            
-            print(f"[Predictor] ✓ Modelo treinado com {len(X)} amostras (Treinamento #{self.total_trainings})")
+            logger.info("[Predictor] ✓ Modelo treinado com %d amostras (Treinamento #%d)", n, self.total_trainings)
             
             # Salvar dados automaticamente após treinar
             self.save_data()
@@ -189,9 +322,26 @@ class CongestionPredictor:
             return True
             
         except Exception as e:
-            print(f"[Predictor] Erro ao treinar modelo: {e}")
+            logger.warning("[Predictor] Erro ao treinar modelo: %s", e)
             return False
     
+    def _set_model(self, scaler: StandardScaler, model) -> None:
+        """
+        Instala o scaler e o modelo e guarda os parâmetros lineares de que a previsão
+        precisa (média, escala, pesos, intercept), num só tuplo trocado de uma vez.
+        """
+        self.scaler, self.model = scaler, model
+        self.linear = (np.asarray(scaler.mean_, dtype=np.float64), np.asarray(scaler.scale_, dtype=np.float64),
+                       np.asarray(model.coef_[0], dtype=np.float64), float(model.intercept_[0]))
+
+    def _decision(self, features: List[float]) -> float:
+        """
+        w·((x - média) / escala) + b para uma amostra, directamente com NumPy: para
+        4 features, o transform/predict do scikit-learn custa muito mais do que a conta.
+        """
+        mean, scale, coef, intercept = self.linear
+        return float(((np.asarray(features, dtype=np.float64) - mean) / scale) @ coef) + intercept
+
     def predict(self, features: List[float]) -> int:
         """
         Faz previsão de congestionamento.
@@ -208,12 +358,10 @@ class CongestionPredictor:
             return 1 if avg_speed < self.congestion_threshold else 0
         
         try:
-            X = np.array([features])
-            X_scaled = self.scaler.transform(X)
-            prediction = self.model.predict(X_scaled)[0]
-            return int(prediction)
+            # mesma decisão que model.predict: classe 1 quando w·x + b > 0
+            return 1 if self._decision(features) > 0 else 0
         except Exception as e:
-            print(f"[Predictor] Erro ao fazer previsão: {e}")
+            logger.warning("[Predictor] Erro ao fazer previsão: %s", e)
             # Fallback para heurística
             avg_speed = features[1]
             return 1 if avg_speed < self.congestion_threshold else 0
@@ -236,13 +384,11 @@ class CongestionPredictor:
             return prob
         
         try:
-            X = np.array([features])
-            X_scaled = self.scaler.transform(X)
-            # Probabilidade da classe 1 (congestionado)
-            probability = self.model.predict_proba(X_scaled)[0][1]
-            return float(probability)
+            # Probabilidade da classe 1 (congestionado): sigmoide da decisão, como predict_proba
+            z = min(max(self._decision(features), -500.0), 500.0)
+            return 1.0 / (1.0 + math.exp(-z))
         except Exception as e:
-            print(f"[Predictor] Erro ao calcular probabilidade: {e}")
+            logger.warning("[Predictor] Erro ao calcular probabilidade: %s", e)
             # Fallback para heurística
             avg_speed = features[1]
             prob = max(0.0, min(1.0, (self.congestion_threshold - avg_speed) / self.congestion_threshold))
@@ -259,7 +405,7 @@ class CongestionPredictor:
             'is_trained': self.is_trained,
             'total_samples_collected': self.total_samples_collected,
             'total_trainings': self.total_trainings,
-            'samples_in_buffer': len(self.training_features),
+            'samples_in_buffer': self.n_samples,
             'min_samples_to_train': self.min_samples_to_train
         }
     
@@ -268,106 +414,123 @@ class CongestionPredictor:
         Salva dados de treinamento e modelo em arquivos.
         
         Salva:
-        - training_data.json: Features, labels e estatísticas
-        - model.pkl: Modelo treinado e scaler (se treinado)
+        - training_data.npz: Features e labels (arrays binários)
+        - training_stats.json: Estatísticas
+        - model.joblib: Modelo treinado e scaler (se treinado)
         
         Returns:
             True se salvou com sucesso
         """
         try:
-            # Salvar dados de treinamento em JSON
-            data_path = os.path.join(self.data_dir, 'training_data.json')
-            training_data = {
-                'features': self.training_features,
-                'labels': self.training_labels,
-                'stats': {
-                    'total_samples_collected': self.total_samples_collected,
-                    'total_trainings': self.total_trainings,
-                    'is_trained': self.is_trained,
-                    'congestion_threshold': self.congestion_threshold,
-                    'min_samples_to_train': self.min_samples_to_train
-                }
-            }
+            # Salvar features/labels em binário (o JSON guardava milhares de floats como texto)
+            np.savez_compressed(
+                os.path.join(self.data_dir, 'training_data.npz'),
+                features=self.training_features,
+                labels=self.training_labels)
             
-            with open(data_path, 'w') as f:
-                json.dump(training_data, f, indent=2)
+            stats = {
+                'total_samples_collected': self.total_samples_collected,
+                'total_trainings': self.total_trainings,
+                'is_trained': self.is_trained,
+                'congestion_threshold': self.congestion_threshold,
+                'min_samples_to_train': self.min_samples_to_train,
+                'trained_samples': self.trained_samples
+            }
+            with open(os.path.join(self.data_dir, 'training_stats.json'), 'w') as f:
+                json.dump(stats, f, indent=2)
             
-            # Salvar modelo treinado em pickle (se treinado)
+            # Salvar modelo treinado com joblib (se treinado)
             if self.is_trained:
-                model_path = os.path.join(self.data_dir, 'model.pkl')
                 model_data = {
                     'model': self.model,
                     'scaler': self.scaler
                 }
-                with open(model_path, 'wb') as f:
-                    pickle.dump(model_data, f)
+                joblib.dump(model_data, os.path.join(self.data_dir, 'model.joblib'))
             
-            print(f"[Predictor] 💾 Dados salvos em {self.data_dir}/")
+            logger.info("[Predictor] 💾 Dados salvos em %s/", self.data_dir)
             return True
             
         except Exception as e:
-            print(f"[Predictor] Erro ao salvar dados: {e}")
+            logger.warning("[Predictor] Erro ao salvar dados: %s", e)
             return False
     
     def load_data(self) -> bool:
         """
         Carrega dados de treinamento e modelo de arquivos.
         
+        Os ficheiros do formato anterior (training_data.json, model.pkl) ainda são lidos
+        quando não existem os novos.
+        
         Returns:
             True se carregou com sucesso
         """
         try:
             # Carregar dados de treinamento
-            data_path = os.path.join(self.data_dir, 'training_data.json')
-            if os.path.exists(data_path):
-                with open(data_path, 'r') as f:
+            npz_path = os.path.join(self.data_dir, 'training_data.npz')
+            stats_path = os.path.join(self.data_dir, 'training_stats.json')
+            legacy_path = os.path.join(self.data_dir, 'training_data.json')
+            stats = None
+            if os.path.exists(npz_path):
+                with np.load(npz_path) as data:
+                    self._set_samples(data['features'], data['labels'])
+                if os.path.exists(stats_path):
+                    with open(stats_path, 'r') as f:
+                        stats = json.load(f)
+            elif os.path.exists(legacy_path):
+                with open(legacy_path, 'r') as f:
                     training_data = json.load(f)
-                
-                self.training_features = training_data['features']
-                self.training_labels = training_data['labels']
-                self.total_samples_collected = training_data['stats']['total_samples_collected']
-                self.total_trainings = training_data['stats']['total_trainings']
-                
-                print(f"[Predictor] 📂 Carregados {len(self.training_features)} amostras de treinamento")
+                self._set_samples(training_data['features'], training_data['labels'])
+                stats = training_data['stats']
+            
+            if stats is not None:
+                self.total_samples_collected = stats['total_samples_collected']
+                self.total_trainings = stats['total_trainings']
+            if self.n_samples:
+                logger.info("[Predictor] 📂 Carregados %d amostras de treinamento", self.n_samples)
             
             # Carregar modelo treinado
-            model_path = os.path.join(self.data_dir, 'model.pkl')
+            model_path = os.path.join(self.data_dir, 'model.joblib')
+            legacy_model_path = os.path.join(self.data_dir, 'model.pkl')
+            model_data = None
             if os.path.exists(model_path):
-                with open(model_path, 'rb') as f:
+                model_data = joblib.load(model_path)
+            elif os.path.exists(legacy_model_path):
+                with open(legacy_model_path, 'rb') as f:
                     model_data = pickle.load(f)
-                
-                self.model = model_data['model']
-                self.scaler = model_data['scaler']
+            
+            if model_data is not None:
+                self._set_model(model_data['scaler'], model_data['model'])
                 self.is_trained = True
+                # um modelo antigo (sem partial_fit) é treinado de novo com todas as amostras
+                if hasattr(self.model, 'partial_fit') and stats is not None:
+                    self.trained_samples = min(stats.get('trained_samples', self.n_samples), self.n_samples)
                 
-                print(f"[Predictor] 📂 Modelo treinado carregado (Treinamentos anteriores: {self.total_trainings})")
+                logger.info("[Predictor] 📂 Modelo treinado carregado (Treinamentos anteriores: %d)", self.total_trainings)
                 return True
             
             return False
             
         except Exception as e:
-            print(f"[Predictor] Aviso ao carregar dados: {e}")
+            logger.warning("[Predictor] Aviso ao carregar dados: %s", e)
             return False
     
     def clear_data(self) -> bool:
         """
-        Limpa todos os dados persistentes (arquivos JSON e pickle).
+        Limpa todos os dados persistentes (incluindo os do formato anterior).
         
         Returns:
             True se limpou com sucesso
         """
         try:
-            data_path = os.path.join(self.data_dir, 'training_data.json')
-            model_path = os.path.join(self.data_dir, 'model.pkl')
-            
-            if os.path.exists(data_path):
-                os.remove(data_path)
-            if os.path.exists(model_path):
-                os.remove(model_path)
+            for name in ('training_data.npz', 'training_stats.json', 'model.joblib',
+                         'training_data.json', 'model.pkl'):
+                path = os.path.join(self.data_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
             
-            print(f"[Predictor] 🗑️  Dados persistentes removidos")
+            logger.info("[Predictor] 🗑️  Dados persistentes removidos")
             return True
             
         except Exception as e:
-            print(f"[Predictor] Erro ao limpar dados: {e}")
+            logger.warning("[Predictor] Erro ao limpar dados: %s", e)
             return False
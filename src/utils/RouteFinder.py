@@ -1,6 +1,32 @@
-import xml.etree.ElementTree as ET
 import heapq
-import traci
+import logging
+import sys
+import threading
+import numpy as np
+try:
+    from utils.traci_compat import traci
+except ImportError:  # imported directly from src/utils (e.g. by the tests)
+    from traci_compat import traci
+
+logger = logging.getLogger(__name__)
+
+# Shortest-path trees kept per closure set (one per start edge, n int32 each)
+ROUTE_TREE_CACHE_SIZE = 256
+
+# lxml's C parser when installed (filters by tag and frees parsed siblings); otherwise the stdlib one
+try:
+    from lxml import etree as ET
+    LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    LXML = False
+
+# SciPy's C Dijkstra (installed with scikit-learn); without it the pure Python search is used
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    dijkstra = None
 
 class RouteFinder:
     def __init__(self, net_file):
@@ -10,41 +36,101 @@ class RouteFinder:
         """
         self.edges = {} # id -> length
         self.graph = {} # id -> [neighbors]
+        self.lane_ids = {} # id -> lane ids, from the <lane> elements of each edge
+        # Closed edges read from TraCI, rebuilt at most once per simulation step
+        self._blocked_edges = frozenset()
+        self._blocked_step = -1
+        # Same graph in CSR form over integer edge indices, for SciPy's Dijkstra
+        self.edge_ids = () # index -> id
+        self.edge_idx = {} # id -> index
+        self.csr_indptr = np.zeros(1, dtype=np.int32)
+        self.csr_indices = np.zeros(0, dtype=np.int32)
+        self.csr_rows = np.zeros(0, dtype=np.int32) # row (source edge) of every entry
+        self.csr_weights = np.zeros(0)
+        self.lengths = [] # index -> length
+        self.neighbours = [] # index -> [neighbour indices]
+        # (closed edges, CSR matrix without them, start index -> predecessors) of the last
+        # search, reused while closures don't change
+        self._closed_graph = (frozenset(), None, {})
+        # Guards _closed_graph and its trees: searches run in executor threads
+        self._cache_lock = threading.Lock()
         self._parse_net(net_file)
 
     def _parse_net(self, net_file):
         """
         Parses the .net.xml file to build the graph.
+        Streams the file with iterparse and frees each element once read, so the
+        whole XML tree is never held in memory. Edge ids are interned: the same id
+        appears in many connections, and the graph then holds one string per edge.
         """
-        tree = ET.parse(net_file)
-        root = tree.getroot()
-
-        # Parse edges
-        for edge in root.findall('edge'):
-            edge_id = edge.get('id')
-            
-            # Skip internal edges (intesections)
-            if edge.get('function') == 'internal':
+        connections = []
+        if LXML:
+            # Only edges and connections are reported; their lanes are read through the edge
+            context = ET.iterparse(net_file, events=('end',), tag=('edge', 'connection'))
+        else:
+            context = ET.iterparse(net_file, events=('end',))
+        for _, elem in context:
+            tag = elem.tag
+            if tag == 'lane':
+                # Read (and freed) together with its edge
                 continue
-            
-            # Get length from the first lane
-            # Structure: <edge ...> <lane ... length="..."/> </edge>
-            lane = edge.find('lane')
-            if lane is not None:
-                length = float(lane.get('length'))
-                self.edges[edge_id] = length
-                self.graph[edge_id] = [] # Initialize adjacency list
+
+            if tag == 'edge':
+                edge_id = sys.intern(elem.get('id'))
+
+                # Skip internal edges (intesections)
+                if elem.get('function') != 'internal':
+                    # Get length from the first lane
+                    # Structure: <edge ...> <lane ... length="..."/> </edge>
+                    lane = elem.find('lane')
+                    if lane is not None:
+                        length = float(lane.get('length'))
+                        self.edges[edge_id] = length
+                        self.graph[edge_id] = [] # Initialize adjacency list
+                        self.lane_ids[edge_id] = tuple(l.get('id') for l in elem.findall('lane'))
+
+            elif tag == 'connection':
+                connections.append((sys.intern(elem.get('from')), sys.intern(elem.get('to'))))
+
+            elem.clear()
+            if LXML:
+                # lxml keeps cleared elements attached to the root: drop the ones already read
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
 
         # Parse connections
-        for conn in root.findall('connection'):
-            from_edge = conn.get('from')
-            to_edge = conn.get('to')
-            
+        # One connection per lane pair: dict.fromkeys drops repeated edge pairs in O(1)
+        # each (keeping file order) instead of scanning the adjacency list for every one
+        for from_edge, to_edge in dict.fromkeys(connections):
             # Ensure both edges exist in our graph (are not internal)
             if from_edge in self.edges and to_edge in self.edges:
-                # Add connection if not already present
-                if to_edge not in self.graph[from_edge]:
-                    self.graph[from_edge].append(to_edge)
+                self.graph[from_edge].append(to_edge)
+
+        self._build_csr()
+
+    def _build_csr(self):
+        """
+        Builds the CSR arrays of the graph: row u lists the edges reachable from u,
+        every entry weighted with the length of u (the cost of traversing u).
+        """
+        self.edge_ids = tuple(self.edges)
+        self.edge_idx = {edge_id: i for i, edge_id in enumerate(self.edge_ids)}
+        degrees = [len(self.graph[edge_id]) for edge_id in self.edge_ids]
+        self.csr_indptr = np.zeros(len(self.edge_ids) + 1, dtype=np.int32)
+        np.cumsum(degrees, out=self.csr_indptr[1:])
+        self.csr_indices = np.fromiter(
+            (self.edge_idx[v] for edge_id in self.edge_ids for v in self.graph[edge_id]),
+            dtype=np.int32, count=int(self.csr_indptr[-1]))
+        self.csr_rows = np.repeat(np.arange(len(self.edge_ids), dtype=np.int32), degrees)
+        self.csr_weights = np.fromiter(
+            (self.edges[edge_id] for edge_id in self.edge_ids), dtype=np.float64,
+            count=len(self.edge_ids))[self.csr_rows]
+        # Same graph as plain lists over the indices, for the Python search (without SciPy)
+        self.lengths = [self.edges[edge_id] for edge_id in self.edge_ids]
+        self.neighbours = [[self.edge_idx[v] for v in self.graph[edge_id]] for edge_id in self.edge_ids]
+        if dijkstra is not None:
+            # Matrix without closures, ready for the first search
+            self._csr_graph(frozenset())
 
     def _is_edge_blocked(self, edge_id):
         """
@@ -56,10 +142,8 @@ class RouteFinder:
             return False
         
         try:
-            lane_count = traci.edge.getLaneNumber(edge_id)
             # Check all lanes - if at least one is open, edge is not blocked
-            for i in range(lane_count):
-                lane_id = f"{edge_id}_{i}"
+            for lane_id in self.lane_ids[edge_id]:
                 disallowed = traci.lane.getDisallowed(lane_id)
                 if "passenger" not in disallowed:
                     # At least one lane is open to passengers
@@ -68,10 +152,21 @@ class RouteFinder:
             return True
         except Exception as e:
             # If error checking edge, assume it's not blocked
-            print(f"Warning: Could not check if edge {edge_id} is blocked: {e}")
+            logger.warning("[RouteFinder] Could not check if edge %s is blocked: %s", edge_id, e)
             return False
 
-    def find_route(self, start_edge, end_edge, check_closures=True):
+    def refresh_closures(self):
+        """
+        Rebuilds the set of closed edges from TraCI, once per simulation step:
+        every search in the same step then tests membership instead of querying SUMO.
+        """
+        step = traci.simulation.getTime()
+        if step != self._blocked_step:
+            self._blocked_edges = frozenset(e for e in self.edges if self._is_edge_blocked(e))
+            self._blocked_step = step
+        return self._blocked_edges
+
+    def find_route(self, start_edge, end_edge, check_closures=True, blocked_edges=None):
         """
         Finds the shortest path between start_edge and end_edge using Dijkstra's algorithm.
         Only returns routes where all edges have at least one open lane.
@@ -79,57 +174,174 @@ class RouteFinder:
         :param start_edge: Starting edge ID
         :param end_edge: Destination edge ID
         :param check_closures: If True, skip edges with all lanes closed (default: True)
+        :param blocked_edges: Optional set of closed edge IDs (e.g. from a TraCI subscription);
+                              when omitted, the per-step set from refresh_closures() is used
         :return: List of edge IDs representing the route, or empty list if no valid route exists
         """
         if start_edge not in self.edges or end_edge not in self.edges:
             # Try to handle the case if start_edge is internal (starts with :) 
             # ideally we would find the outgoing edge from this internal edge, but keeping it simple for now.
-            print(f"Error: Start edge '{start_edge}' or End edge '{end_edge}' not found in the network.")
+            logger.warning("[RouteFinder] Start edge '%s' or End edge '%s' not found in the network.", start_edge, end_edge)
             return []
 
+        if check_closures and blocked_edges is None:
+            if traci.isLoaded():
+                blocked_edges = self.refresh_closures()
+            else:
+                # Without TraCI no edge can be closed
+                check_closures = False
+
+        # One C Dijkstra over the CSR graph; the Python search below without SciPy
+        if dijkstra is not None:
+            return self._find_route_csr(start_edge, end_edge, blocked_edges if check_closures else None)
+
+        # Dense lists indexed by edge index instead of dicts keyed by edge id
+        n = len(self.edge_ids)
+        start, end = self.edge_idx[start_edge], self.edge_idx[end_edge]
+        blocked = [False] * n
+        if check_closures:
+            for e in blocked_edges:
+                i = self.edge_idx.get(e)
+                if i is not None:
+                    blocked[i] = True
+        lengths, neighbours = self.lengths, self.neighbours
+
         # Priority Queue: (cost, current_edge)
-        pq = [(0, start_edge)]
+        pq = [(0, start)]
         
         # Track distances and parents for path reconstruction
-        costs = {start_edge: 0}
-        parents = {start_edge: None}
-        visited = set()
+        costs = [float('inf')] * n
+        costs[start] = 0
+        parents = [-1] * n
 
         while pq:
             current_cost, u = heapq.heappop(pq)
 
-            if u == end_edge:
+            if u == end:
                 break
             
-            if u in visited:
+            # Lazy deletion: a cheaper entry for u was pushed after this one
+            if current_cost > costs[u]:
                 continue
-            visited.add(u)
 
-            if u in self.graph:
-                for v in self.graph[u]:
-                    # Skip this edge if it's blocked (all lanes closed)
-                    if check_closures and self._is_edge_blocked(v):
+            # Weight is the length of the current edge 'u'.
+            # We assume cost is traversing 'u' to get to 'v', the same for every neighbour.
+            new_cost = current_cost + lengths[u]
+
+            for v in neighbours[u]:
+                # Skip this edge if it's blocked (all lanes closed); checked only for
+                # neighbours the search would actually improve
+                if new_cost < costs[v]:
+                    if blocked[v]:
                         continue
-                    
-                    # Weight is the length of the current edge 'u'.
-                    # We assume cost is traversing 'u' to get to 'v'.
-                    weight = self.edges[u]
-                    new_cost = current_cost + weight
-                    
-                    if new_cost < costs.get(v, float('inf')):
-                        costs[v] = new_cost
-                        parents[v] = u
-                        heapq.heappush(pq, (new_cost, v))
+                    costs[v] = new_cost
+                    parents[v] = u
+                    heapq.heappush(pq, (new_cost, v))
 
         # Reconstruct path
-        if end_edge not in parents:
-            print(f"No path found between {start_edge} and {end_edge}")
+        if end != start and parents[end] < 0:
+            logger.debug("[RouteFinder] No path found between %s and %s", start_edge, end_edge)
             return []
             
-        path = []
-        curr = end_edge
-        while curr:
-            path.append(curr)
-            curr = parents[curr]
-        
-        return path[::-1] # Reverse connection to get start -> end
+        return self._walk_back(parents, start, end)
+
+    def find_routes_many(self, pairs, check_closures=True, blocked_edges=None):
+        """
+        find_route for many (start_edge, end_edge) pairs at once, e.g. every vehicle
+        rerouting in the same step. With SciPy the shortest-path trees of all the
+        distinct start edges are solved in one call, so K pairs sharing S starts cost
+        S searches; each route is then read from its start's tree.
+
+        :param pairs: Iterable of (start_edge, end_edge)
+        :param check_closures: as in find_route
+        :param blocked_edges: as in find_route
+        :return: List of routes (lists of edge IDs, empty if none), in the order of pairs
+        """
+        pairs = list(pairs)
+        if check_closures and blocked_edges is None:
+            if traci.isLoaded():
+                blocked_edges = self.refresh_closures()
+            else:
+                check_closures = False
+
+        if dijkstra is not None:
+            graph, trees = self._csr_graph(blocked_edges if check_closures and blocked_edges else frozenset())
+            with self._cache_lock:
+                starts = sorted({self.edge_idx[s] for s, e in pairs
+                                 if s in self.edge_idx and e in self.edge_idx} - trees.keys())
+            if starts:
+                _, predecessors = dijkstra(graph, indices=starts, return_predecessors=True)
+                with self._cache_lock:
+                    if len(trees) + len(starts) > ROUTE_TREE_CACHE_SIZE:
+                        trees.clear()
+                    trees.update(zip(starts, predecessors))
+
+        return [self.find_route(s, e, check_closures, blocked_edges) for s, e in pairs]
+
+    def _find_route_csr(self, start_edge, end_edge, blocked_edges=None):
+        """
+        find_route with SciPy's Dijkstra. Entries leading into a blocked edge are
+        dropped, as the Python search skips them.
+        """
+        start, end = self.edge_idx[start_edge], self.edge_idx[end_edge]
+        graph, trees = self._csr_graph(blocked_edges or frozenset())
+        # SciPy solves from start to every edge: later searches from the same start
+        # (any destination) under the same closures just walk the stored tree
+        with self._cache_lock:
+            predecessors = trees.get(start)
+        if predecessors is None:
+            # solved outside the lock: other threads keep reading the stored trees
+            _, predecessors = dijkstra(graph, indices=start, return_predecessors=True)
+            with self._cache_lock:
+                if len(trees) >= ROUTE_TREE_CACHE_SIZE:
+                    trees.clear()
+                trees[start] = predecessors
+
+        if end != start and predecessors[end] < 0:
+            logger.debug("[RouteFinder] No path found between %s and %s", start_edge, end_edge)
+            return []
+
+        return self._walk_back(predecessors, start, end)
+
+    def _walk_back(self, parents, start, end):
+        """
+        Route from start to end read from a parent array (end must be reachable):
+        one list of edge ids, built backwards and reversed in place.
+        """
+        edge_ids = self.edge_ids
+        path = [edge_ids[end]]
+        i = end
+        while i != start:
+            i = parents[i]
+            path.append(edge_ids[i])
+        path.reverse() # Reverse connection to get start -> end
+        return path
+
+    def _csr_graph(self, blocked_edges):
+        """
+        CSR matrix of the graph without the entries leading into a blocked edge, and the
+        shortest-path trees already solved on it.
+        Closures change at most once per step, so the matrix of the last set is kept
+        and the masking is redone only when a different set comes in (under the cache
+        lock, so threads never see a matrix with the trees of another closure set).
+        """
+        with self._cache_lock:
+            closed, graph, trees = self._closed_graph
+            if graph is not None and (closed is blocked_edges or closed == blocked_edges):
+                return graph, trees
+
+            indptr, indices, weights = self.csr_indptr, self.csr_indices, self.csr_weights
+            n = len(self.edge_ids)
+            if blocked_edges:
+                # Bitmask over edge indices: one vectorised lookup per CSR entry
+                blocked = np.zeros(n, dtype=bool)
+                blocked[[self.edge_idx[e] for e in blocked_edges if e in self.edge_idx]] = True
+                keep = ~blocked[indices]
+                indptr = np.zeros_like(indptr)
+                np.cumsum(np.bincount(self.csr_rows[keep], minlength=n), out=indptr[1:])
+                indices, weights = indices[keep], weights[keep]
+
+            graph = csr_matrix((weights, indices, indptr), shape=(n, n))
+            trees = {}
+            self._closed_graph = (frozenset(blocked_edges), graph, trees)
+            return graph, trees
@@ -0,0 +1,178 @@
+"""
+WorldSnapshot - Estado da simulação partilhado por todos os agentes
+
+Em vez de cada agente perguntar ao SUMO a lista de veículos, os chegados ou o
+tempo actual (um pedido TraCI por agente e por ciclo), um único StepListener
+actualiza o objecto WORLD depois de cada traci.simulationStep() a partir das
+subscrições TraCI, e os agentes lêem apenas da memória.
+
+O SUMO guarda uma única lista de variáveis por objecto: subscrever de novo o mesmo
+veículo (lane ou semáforo) substitui as variáveis subscritas antes. Por isso os agentes
+não devem subscrever veículos, lanes nem semáforos directamente; registam aqui as
+variáveis de que precisam com WORLD.require() / WORLD.require_lanes() /
+WORLD.require_tls() e cada objecto é subscrito com a união.
+
+Todos os agentes correm no mesmo event loop que chama traci.simulationStep(), por
+isso o snapshot nunca é lido a meio de uma actualização.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from utils.traci_compat import traci
+import traci.constants as tc
+from typing import AbstractSet, Dict, FrozenSet, Iterable, Set
+
+
+@dataclass
+class WorldSnapshot:
+    """
+    Fotografia da simulação no último passo.
+
+    - time: Tempo de simulação (s)
+    - vehicle_ids: Veículos em simulação
+    - arrived: Veículos que chegaram ao destino no último passo
+    - min_expected: Veículos em simulação ou ainda por partir (0 quando a simulação acabou)
+    - vehicle_vars: {veh_id: {variável: valor}} das variáveis subscritas
+    - lane_vars: {lane_id: {variável: valor}} das variáveis de lane subscritas
+    - tls_vars: {tls_id: {variável: valor}} das variáveis de semáforo subscritas
+    - version: Incrementado a cada actualização
+    - ready: Evento assinalado quando o SUMO está ligado e o snapshot instalado
+    - step_event: Evento do próximo passo (ver next_step)
+    """
+    time: float = 0.0
+    vehicle_ids: AbstractSet[str] = frozenset()
+    arrived: FrozenSet[str] = frozenset()
+    min_expected: int = 0
+    vehicle_vars: Dict[str, dict] = field(default_factory=dict)
+    lane_vars: Dict[str, dict] = field(default_factory=dict)
+    tls_vars: Dict[str, dict] = field(default_factory=dict)
+    version: int = 0
+
+    # União das variáveis de veículo pedidas por todos os agentes
+    variables: Set[int] = field(default_factory=set)
+    # Variáveis pedidas por lane (lane_id -> união das variáveis)
+    lane_variables: Dict[str, Set[int]] = field(default_factory=dict)
+    # Variáveis pedidas por semáforo (tls_id -> união das variáveis)
+    tls_variables: Dict[str, Set[int]] = field(default_factory=dict)
+    installed: bool = False
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    step_event: asyncio.Event = field(default_factory=asyncio.Event)
+
+    class _Listener(traci.StepListener):
+        def __init__(self, world):
+            self.world = world
+
+        def step(self, t=0):
+            self.world.refresh()
+            return True
+
+    def install(self) -> None:
+        """
+        Subscreve as variáveis da simulação e regista o StepListener (uma única vez).
+        """
+        if self.installed or not traci.isLoaded():
+            return
+        traci.simulation.subscribe([tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_ARRIVED_VEHICLES_IDS,
+                                    tc.VAR_MIN_EXPECTED_VEHICLES])
+        traci.addStepListener(self._Listener(self))
+        self.installed = True
+        self.refresh()
+        self.ready.set()
+
+    def require(self, variables: Iterable[int]) -> None:
+        """
+        Regista variáveis de veículo a subscrever (e.g. tc.VAR_SPEED).
+
+        Se forem pedidas variáveis novas, os veículos já em simulação são
+        subscritos de novo com a união.
+        """
+        if not traci.isLoaded():
+            return
+        self.install()
+
+        new_variables = set(variables) - self.variables
+        if new_variables:
+            self.variables |= new_variables
+            var_list = sorted(self.variables)
+            for veh_id in self.vehicle_ids:
+                traci.vehicle.subscribe(veh_id, var_list)
+            self.vehicle_vars = traci.vehicle.getAllSubscriptionResults()
+
+    def require_lanes(self, lane_ids: Iterable[str], variables: Iterable[int]) -> None:
+        """
+        Regista variáveis a subscrever nas lanes dadas (e.g. tc.LANE_DISALLOWED).
+
+        Cada lane é subscrita com a união das variáveis pedidas por todos os agentes;
+        só é subscrita de novo se lhe forem pedidas variáveis novas.
+        """
+        if not traci.isLoaded():
+            return
+        self.install()
+
+        variables = set(variables)
+        for lane_id in lane_ids:
+            current = self.lane_variables.setdefault(lane_id, set())
+            if not variables <= current:
+                current |= variables
+                traci.lane.subscribe(lane_id, sorted(current))
+        self.lane_vars = traci.lane.getAllSubscriptionResults()
+
+    def require_tls(self, tls_ids: Iterable[str], variables: Iterable[int]) -> None:
+        """
+        Regista variáveis a subscrever nos semáforos dados (e.g. tc.TL_CURRENT_PHASE).
+
+        Como nas lanes, cada semáforo é subscrito com a união das variáveis pedidas.
+        """
+        if not traci.isLoaded():
+            return
+        self.install()
+
+        variables = set(variables)
+        for tls_id in tls_ids:
+            current = self.tls_variables.setdefault(tls_id, set())
+            if not variables <= current:
+                current |= variables
+                traci.trafficlight.subscribe(tls_id, sorted(current))
+        self.tls_vars = traci.trafficlight.getAllSubscriptionResults()
+
+    async def next_step(self) -> None:
+        """
+        Espera pela próxima actualização do snapshot (um passo de simulação), para
+        comportamentos que acompanham o ritmo dos passos sem fazer polling.
+        """
+        await self.step_event.wait()
+
+    def refresh(self) -> None:
+        """
+        Actualiza o snapshot a partir dos resultados das subscrições (sem pedidos ao SUMO,
+        excepto para subscrever os veículos que acabaram de partir).
+        """
+        sim = traci.simulation.getSubscriptionResults()
+
+        if self.variables:
+            var_list = sorted(self.variables)
+            for veh_id in sim.get(tc.VAR_DEPARTED_VEHICLES_IDS, ()):
+                traci.vehicle.subscribe(veh_id, var_list)
+
+        self.time = sim.get(tc.VAR_TIME, self.time)
+        self.arrived = frozenset(sim.get(tc.VAR_ARRIVED_VEHICLES_IDS, ()))
+        self.min_expected = sim.get(tc.VAR_MIN_EXPECTED_VEHICLES, self.min_expected)
+        self.vehicle_vars = traci.vehicle.getAllSubscriptionResults()
+        if self.lane_variables:
+            self.lane_vars = traci.lane.getAllSubscriptionResults()
+        if self.tls_variables:
+            self.tls_vars = traci.trafficlight.getAllSubscriptionResults()
+        if self.variables:
+            # todos os veículos estão subscritos: as chaves dos resultados são os
+            # veículos em simulação (vista sem cópia, dispensa o getIDList)
+            self.vehicle_ids = self.vehicle_vars.keys()
+        else:
+            self.vehicle_ids = frozenset(traci.vehicle.getIDList())
+        self.version += 1
+        # acorda quem espera por este passo; os seguintes esperam por um evento novo
+        event, self.step_event = self.step_event, asyncio.Event()
+        event.set()
+
+
+# Instância única partilhada por todos os agentes
+WORLD = WorldSnapshot()
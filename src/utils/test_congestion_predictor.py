@@ -5,17 +5,31 @@ Execução:
     pytest src/utils/test_congestion_predictor.py -v
 """
 
+import json
+import os
+import pickle
+
 import pytest
 import numpy as np
 from CongestionPredictor import CongestionPredictor
 
 
+def trained_predictor(data_dir):
+    """Preditor treinado com dados sintéticos (20 amostras, 2 classes) em data_dir"""
+    predictor = CongestionPredictor(min_samples_to_train=10, data_dir=data_dir)
+    for i in range(10):
+        predictor.add_sample([5.0 + i, 15.0 + i, 2.0, 8.0], 0)
+        predictor.add_sample([50.0 + i, 3.0, 5.0, 80.0], 1)
+    assert predictor.train()
+    return predictor
+
+
 class TestCongestionPredictor:
     """Testes para a classe CongestionPredictor"""
     
-    def test_initialization(self):
+    def test_initialization(self, tmp_path):
         """Testa a inicialização do preditor"""
-        predictor = CongestionPredictor(congestion_threshold=5.0, min_samples_to_train=10)
+        predictor = CongestionPredictor(congestion_threshold=5.0, min_samples_to_train=10, data_dir=str(tmp_path))
         
         assert predictor.congestion_threshold == 5.0
         assert predictor.min_samples_to_train == 10
@@ -23,9 +37,9 @@ class TestCongestionPredictor:
         assert predictor.total_samples_collected == 0
         assert len(predictor.training_features) == 0
     
-    def test_add_sample(self):
+    def test_add_sample(self, tmp_path):
         """Testa a adição de amostras"""
-        predictor = CongestionPredictor(min_samples_to_train=5)
+        predictor = CongestionPredictor(min_samples_to_train=5, data_dir=str(tmp_path))
         
         features = [10.0, 8.5, 2.3, 15.0]
         label = 0
@@ -36,9 +50,9 @@ class TestCongestionPredictor:
         assert len(predictor.training_labels) == 1
         assert predictor.total_samples_collected == 1
     
-    def test_should_train(self):
+    def test_should_train(self, tmp_path):
         """Testa a lógica de quando treinar"""
-        predictor = CongestionPredictor(min_samples_to_train=3)
+        predictor = CongestionPredictor(min_samples_to_train=3, data_dir=str(tmp_path))
         
         assert predictor.should_train() == False
         
@@ -48,9 +62,9 @@ class TestCongestionPredictor:
         
         assert predictor.should_train() == True
     
-    def test_training_with_synthetic_data(self):
+    def test_training_with_synthetic_data(self, tmp_path):
         """Testa o treinamento com dados sintéticos"""
-        predictor = CongestionPredictor(min_samples_to_train=10)
+        predictor = CongestionPredictor(min_samples_to_train=10, data_dir=str(tmp_path))
         
         # Criar dados sintéticos
         # Classe 0: Tráfego normal (alta velocidade, poucos veículos)
@@ -70,9 +84,9 @@ class TestCongestionPredictor:
         assert predictor.is_trained == True
         assert predictor.total_trainings == 1
     
-    def test_prediction_before_training(self):
+    def test_prediction_before_training(self, tmp_path):
         """Testa previsão antes do treinamento (deve usar heurística)"""
-        predictor = CongestionPredictor(congestion_threshold=5.0)
+        predictor = CongestionPredictor(congestion_threshold=5.0, data_dir=str(tmp_path))
         
         # Tráfego normal (velocidade alta)
         features_normal = [10.0, 15.0, 2.0, 10.0]
@@ -84,9 +98,9 @@ class TestCongestionPredictor:
         prediction = predictor.predict(features_congested)
         assert prediction == 1
     
-    def test_prediction_after_training(self):
+    def test_prediction_after_training(self, tmp_path):
         """Testa previsão após treinamento"""
-        predictor = CongestionPredictor(min_samples_to_train=10)
+        predictor = CongestionPredictor(min_samples_to_train=10, data_dir=str(tmp_path))
         
         # Criar e treinar com dados sintéticos
         for i in range(10):
@@ -105,9 +119,9 @@ class TestCongestionPredictor:
         prediction = predictor.predict(features_congested)
         assert prediction == 1
     
-    def test_congestion_probability(self):
+    def test_congestion_probability(self, tmp_path):
         """Testa o cálculo de probabilidade"""
-        predictor = CongestionPredictor(congestion_threshold=5.0)
+        predictor = CongestionPredictor(congestion_threshold=5.0, data_dir=str(tmp_path))
         
         # Tráfego normal
         features_normal = [10.0, 15.0, 2.0, 10.0]
@@ -121,9 +135,9 @@ class TestCongestionPredictor:
         assert 0.0 <= prob <= 1.0
         assert prob > 0.5  # Deve ser alta probabilidade
     
-    def test_get_stats(self):
+    def test_get_stats(self, tmp_path):
         """Testa a obtenção de estatísticas"""
-        predictor = CongestionPredictor(min_samples_to_train=5)
+        predictor = CongestionPredictor(min_samples_to_train=5, data_dir=str(tmp_path))
         
         predictor.add_sample([10.0, 8.0, 1.0, 10.0], 0)
         predictor.add_sample([15.0, 7.0, 2.0, 12.0], 0)
@@ -136,9 +150,9 @@ class TestCongestionPredictor:
         assert stats['samples_in_buffer'] == 2
         assert stats['min_samples_to_train'] == 5
     
-    def test_training_with_single_class(self):
+    def test_training_with_single_class(self, tmp_path):
         """Testa que o treinamento falha graciosamente com apenas uma classe"""
-        predictor = CongestionPredictor(min_samples_to_train=5)
+        predictor = CongestionPredictor(min_samples_to_train=5, data_dir=str(tmp_path))
         
         # Adicionar apenas amostras da classe 0
         for i in range(10):
@@ -148,6 +162,67 @@ class TestCongestionPredictor:
         success = predictor.train()
         assert success == False
         assert predictor.is_trained == False
+    
+    def test_network_length_from_net_file(self, tmp_path):
+        """O comprimento da rede é lido do .net.xml (sem TraCI); um ficheiro ilegível recorre ao TraCI"""
+        net_file = os.path.join(os.path.dirname(__file__), '../../sumo_environment/network.net.xml')
+        predictor = CongestionPredictor(data_dir=str(tmp_path), net_file=net_file)
+        assert predictor._get_network_length() == pytest.approx(4881.56)
+        
+        # sem SUMO ligado, o TraCI também falha e fica o valor por omissão
+        predictor = CongestionPredictor(data_dir=str(tmp_path), net_file=str(tmp_path / 'missing.net.xml'))
+        assert predictor._get_network_length() == 10000.0
+    
+    def test_save_and_reload(self, tmp_path):
+        """Amostras, estatísticas e modelo guardados são recuperados por um novo preditor"""
+        predictor = trained_predictor(str(tmp_path))
+        predictor.add_sample([12.0, 10.0, 2.0, 20.0], 0)
+        assert predictor.save_data()
+        assert (tmp_path / 'training_data.npz').exists()
+        assert (tmp_path / 'model.joblib').exists()
+        
+        reloaded = CongestionPredictor(min_samples_to_train=10, data_dir=str(tmp_path))
+        
+        assert reloaded.is_trained == True
+        assert reloaded.n_samples == 21
+        assert reloaded.trained_samples == 20
+        assert reloaded.total_samples_collected == 21
+        assert reloaded.total_trainings == 1
+        np.testing.assert_array_equal(reloaded.training_features, predictor.training_features)
+        np.testing.assert_array_equal(reloaded.training_labels, predictor.training_labels)
+        for features in ([10.0, 15.0, 2.0, 10.0], [55.0, 2.0, 5.0, 90.0], [30.0, 8.0, 3.0, 40.0]):
+            assert reloaded.predict(features) == predictor.predict(features)
+            assert reloaded.get_congestion_probability(features) == pytest.approx(
+                predictor.get_congestion_probability(features))
+    
+    def test_load_legacy_files(self, tmp_path):
+        """Sem os ficheiros novos, training_data.json e model.pkl do formato anterior são lidos"""
+        trained = trained_predictor(str(tmp_path / 'trained'))
+        legacy = {
+            'features': trained.training_features.tolist(),
+            'labels': trained.training_labels.tolist(),
+            'stats': {'total_samples_collected': 20, 'total_trainings': 3}
+        }
+        with open(tmp_path / 'training_data.json', 'w') as f:
+            json.dump(legacy, f)
+        with open(tmp_path / 'model.pkl', 'wb') as f:
+            pickle.dump({'model': trained.model, 'scaler': trained.scaler}, f)
+        
+        predictor = CongestionPredictor(min_samples_to_train=10, data_dir=str(tmp_path))
+        
+        assert predictor.is_trained == True
+        assert predictor.n_samples == 20
+        assert predictor.total_samples_collected == 20
+        assert predictor.total_trainings == 3
+        np.testing.assert_array_equal(predictor.training_features, trained.training_features)
+        np.testing.assert_array_equal(predictor.training_labels, trained.training_labels)
+        assert predictor.predict([55.0, 2.0, 5.0, 90.0]) == 1
+        assert predictor.predict([10.0, 15.0, 2.0, 10.0]) == 0
+        
+        # o formato novo passa a ser usado a partir do próximo save
+        assert predictor.save_data()
+        assert (tmp_path / 'training_data.npz').exists()
+        assert (tmp_path / 'model.joblib').exists()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+"""
+Testes do WorldSnapshot contra o SUMO (rede e viagens em sumo_environment)
+
+Execução:
+    pytest src/utils/test_world_snapshot.py -v
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import traci.constants as tc
+from utils.traci_compat import traci
+from utils.WorldSnapshot import WorldSnapshot
+
+SUMO_CFG = os.path.join(os.path.dirname(__file__), '../../sumo_environment/map.sumocfg')
+
+needs_sumo = pytest.mark.skipif(shutil.which("sumo") is None, reason="SUMO não instalado")
+
+
+@pytest.fixture
+def sumo(monkeypatch):
+    """
+    Simulação headless da rede do projecto, fechada no fim do teste com os step listeners
+    que o teste registou (o libsumo mantém-nos depois do close e passariam ao teste seguinte).
+    """
+    traci.start(["sumo", "-c", SUMO_CFG, "--no-step-log", "--no-warnings"])
+    listener_ids = []
+    add_step_listener = traci.addStepListener
+
+    def add_and_record(listener):
+        listener_id = add_step_listener(listener)
+        listener_ids.append(listener_id)
+        return listener_id
+
+    monkeypatch.setattr(traci, "addStepListener", add_and_record)
+    yield
+    for listener_id in listener_ids:
+        traci.removeStepListener(listener_id)
+    traci.close()
+
+
+def step_until_vehicles(world, max_steps=50):
+    for _ in range(max_steps):
+        traci.simulationStep()
+        if world.vehicle_ids:
+            return
+    pytest.fail("nenhum veículo partiu")
+
+
+def test_require_without_sumo_is_a_noop():
+    """Sem o SUMO ligado, os pedidos de subscrição são ignorados"""
+    if traci.isLoaded():
+        pytest.skip("SUMO ligado")
+    world = WorldSnapshot()
+    world.require([tc.VAR_SPEED])
+    world.require_lanes(["E0_0"], [tc.LANE_DISALLOWED])
+    world.require_tls(["J1"], [tc.TL_CURRENT_PHASE])
+    assert not world.installed
+    assert not world.variables and not world.lane_variables and not world.tls_variables
+
+
+@needs_sumo
+def test_refresh_follows_the_simulation(sumo):
+    """Cada passo actualiza tempo, versão, veículos, chegados e min_expected"""
+    world = WorldSnapshot()
+    world.install()
+    assert world.ready.is_set()
+    version = world.version
+
+    for _ in range(30):
+        traci.simulationStep()
+        assert world.time == traci.simulation.getTime()
+        assert world.vehicle_ids == set(traci.vehicle.getIDList())
+        assert world.min_expected == traci.simulation.getMinExpectedNumber()
+        assert world.arrived == set(traci.simulation.getArrivedIDList())
+    assert world.version == version + 30
+    assert world.min_expected > 0
+
+
+@needs_sumo
+def test_require_subscribes_the_union(sumo):
+    """Variáveis pedidas em vezes diferentes chegam todas, para veículos já em simulação e novos"""
+    world = WorldSnapshot()
+    world.install()
+    world.require([tc.VAR_SPEED])
+    step_until_vehicles(world)
+    running = set(world.vehicle_ids)
+
+    world.require([tc.VAR_LANE_ID])
+    assert world.variables == {tc.VAR_SPEED, tc.VAR_LANE_ID}
+    for _ in range(20):
+        traci.simulationStep()
+    assert set(world.vehicle_ids) - running  # partiram veículos depois do segundo pedido
+    for veh_id, data in world.vehicle_vars.items():
+        assert data.keys() == {tc.VAR_SPEED, tc.VAR_LANE_ID}
+        assert data[tc.VAR_LANE_ID] == traci.vehicle.getLaneID(veh_id)
+
+
+@needs_sumo
+def test_require_car_info_variables(sumo):
+    """As variáveis do CarInfoAgent podem ser subscritas num veículo real"""
+    pytest.importorskip("spade")
+    from agents.CarInfo import CarInfoAgent
+    world = WorldSnapshot()
+    world.install()
+    world.require(CarInfoAgent.VEHICLE_VARIABLES)
+    step_until_vehicles(world)
+    for data in world.vehicle_vars.values():
+        assert set(CarInfoAgent.VEHICLE_VARIABLES) <= data.keys()
+
+
+@needs_sumo
+def test_require_lanes_and_tls_subscribe_the_union(sumo):
+    """Lanes e semáforos pedidos por agentes diferentes são subscritos com a união das variáveis"""
+    world = WorldSnapshot()
+    world.install()
+    lanes = tuple(dict.fromkeys(traci.trafficlight.getControlledLanes("J1")))  # sem repetições
+    world.require_lanes(lanes, [tc.LAST_STEP_VEHICLE_NUMBER])
+    world.require_lanes(lanes[:1], [tc.LANE_DISALLOWED])
+    world.require_tls(["J1"], [tc.TL_CURRENT_PHASE])
+    world.require_tls(["J1"], [tc.TL_CURRENT_PROGRAM])
+    traci.simulationStep()
+
+    assert world.lane_vars[lanes[0]].keys() == {tc.LAST_STEP_VEHICLE_NUMBER, tc.LANE_DISALLOWED}
+    for lane in lanes[1:]:
+        assert world.lane_vars[lane].keys() == {tc.LAST_STEP_VEHICLE_NUMBER}
+    assert world.tls_vars["J1"] == {tc.TL_CURRENT_PHASE: traci.trafficlight.getPhase("J1"),
+                                    tc.TL_CURRENT_PROGRAM: traci.trafficlight.getProgram("J1")}
+
+
+@needs_sumo
+def test_next_step_wakes_once_per_step(sumo):
+    """next_step acorda quem espera uma vez por cada passo de simulação"""
+    world = WorldSnapshot()
+    world.install()
+
+    async def run():
+        seen = []
+
+        async def watcher():
+            while True:
+                await world.next_step()
+                seen.append(world.time)
+
+        task = asyncio.create_task(watcher())
+        await asyncio.sleep(0)
+        for _ in range(10):
+            traci.simulationStep()
+            await asyncio.sleep(0)
+        task.cancel()
+        return seen
+
+    assert asyncio.run(run()) == [float(t) for t in range(1, 11)]
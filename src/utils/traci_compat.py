@@ -0,0 +1,23 @@
+"""
+traci_compat - Selecção do backend TraCI partilhado por todos os agentes
+
+Por omissão é usado o cliente TraCI por socket, necessário para correr com o
+sumo-gui. Com a variável de ambiente ARCANUM_USE_LIBSUMO=1 é usado o libsumo:
+o SUMO corre dentro do próprio processo Python e cada chamada deixa de passar
+por TCP. A API é a mesma, mas o libsumo não tem GUI nem suporta vários clientes.
+
+Todos os módulos devem importar o traci daqui para partilharem a mesma ligação.
+"""
+
+import os
+
+if os.getenv("ARCANUM_USE_LIBSUMO") == "1":
+    try:
+        import libsumo as traci
+    except ImportError:
+        print("[traci_compat] libsumo não disponível, a usar TraCI por socket")
+        import traci
+else:
+    import traci
+
+USE_LIBSUMO = traci.isLibsumo()